@@ -0,0 +1,497 @@
+"""Offline load test for the PRL bot.
+
+Drives the real slash command handlers and Join button / name modal callbacks
+from prlbot.py against in-process fakes of the Discord objects they touch
+(Interaction, Guild, Thread, Member, channels) and of the REST API behind
+them. Nothing connects to Discord and no token is needed.
+
+    python loadtest.py --users 2000 --latency 40 --jitter 20 --rate-limit 0.01
+
+Bursts that post into one channel (every lobby announcement goes to
+match-hosting) are paced by the bot's per-route budget just as in
+production, so wall times there reflect the scheduler, not the fakes.
+
+Every run works in a fresh temporary directory, so the bot's data files and
+journals never touch the real ones.
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import discord
+from discord import app_commands
+
+prl = None  # prlbot, imported once we're inside the scratch directory
+
+MATCH_HOSTING_CHANNEL_ID = 1354174076998127873
+LOG_CHANNEL_ID = 1357869099958403072
+LOBBY_CHANNEL_ID = 1400000000000000001
+
+_ids = itertools.count(1500000000000000000)
+http_log = logging.getLogger("discord.http")
+
+
+# ——— Fake REST layer ———
+class FakeAPI:
+    """Stands in for Discord's HTTP API: every call sleeps, some get a 429 first.
+
+    429s are retried after ``retry_after`` the way discord.py's HTTP client
+    does it, and logged with the same message, so the bot's own 429 counter
+    sees them too.
+    """
+
+    def __init__(self, latency_ms: float, jitter_ms: float, rate_limit: float, retry_after: float, rng: random.Random):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.rng = rng
+        self.calls = Counter()
+        self.rate_limited = Counter()
+
+    async def request(self, method: str, path: str):
+        route = f"{method} {re.sub(r'/[0-9]{15,21}', '/:id', path)}"
+        self.calls[route] += 1
+        while True:
+            await asyncio.sleep(max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter)))
+            if self.rng.random() >= self.rate_limit:
+                return
+            self.rate_limited[route] += 1
+            http_log.warning(
+                "We are being rate limited. %s %s responded with 429. Retrying in %.2f seconds.",
+                method, f"https://discord.com/api/v10{path}", self.retry_after
+            )
+            await asyncio.sleep(self.retry_after)
+
+
+# ——— Fake Discord objects ———
+class FakeRole:
+    def __init__(self, name: str):
+        self.id = next(_ids)
+        self.name = name
+        self.mention = f"<@&{self.id}>"
+
+
+class FakeMember:
+    def __init__(self, api: FakeAPI, guild: "FakeGuild", name: str, roles: list):
+        self.api = api
+        self.guild = guild
+        self.id = next(_ids)
+        self.name = name
+        self.display_name = name
+        self.mention = f"<@{self.id}>"
+        self.roles = roles
+
+    @property
+    def _roles(self):
+        return [r.id for r in self.roles]
+
+    def get_role(self, role_id: int):
+        return next((r for r in self.roles if r.id == role_id), None)
+
+    async def add_roles(self, *roles, reason=None):
+        for role in roles:
+            await self.api.request("PUT", f"/guilds/{self.guild.id}/members/{self.id}/roles/{role.id}")
+            if role not in self.roles:
+                self.roles.append(role)
+
+    async def remove_roles(self, *roles, reason=None):
+        for role in roles:
+            await self.api.request("DELETE", f"/guilds/{self.guild.id}/members/{self.id}/roles/{role.id}")
+            if role in self.roles:
+                self.roles.remove(role)
+
+
+class FakeMessage:
+    def __init__(self, api: FakeAPI, channel, view=None, embeds=()):
+        self.api = api
+        self.channel = channel
+        self.id = next(_ids)
+        self.view = view
+        self.author = channel.guild.me
+        self.embeds = list(embeds)
+
+    async def edit(self, **kwargs):
+        await self.api.request("PATCH", f"/channels/{self.channel.id}/messages/{self.id}")
+        return self
+
+    async def pin(self):
+        await self.api.request("PUT", f"/channels/{self.channel.id}/pins/{self.id}")
+        self.channel.pinned.append(self)
+
+
+class FakeChannel:
+    def __init__(self, api: FakeAPI, guild: "FakeGuild", name: str, channel_id=None):
+        self.api = api
+        self.guild = guild
+        self.id = channel_id or next(_ids)
+        self.name = name
+        self.mention = f"<#{self.id}>"
+        self.with_views = []  # posted messages carrying components, i.e. the lobby Join buttons
+        self.pinned = []
+
+    async def send(self, content=None, *, embed=None, embeds=None, view=None, **kwargs):
+        await self.api.request("POST", f"/channels/{self.id}/messages")
+        message = FakeMessage(self.api, self, view=view, embeds=[embed] if embed else embeds or ())
+        if view is not None:
+            self.with_views.append(message)
+        return message
+
+    async def create_thread(self, *, name: str, **kwargs):
+        await self.api.request("POST", f"/channels/{self.id}/threads")
+        thread = FakeThread(self.api, self.guild, name)
+        self.guild.threads[thread.id] = thread
+        return thread
+
+    async def pins(self):
+        await self.api.request("GET", f"/channels/{self.id}/pins")
+        return list(self.pinned)
+
+
+class FakeThread(FakeChannel):
+    def __init__(self, api: FakeAPI, guild: "FakeGuild", name: str):
+        super().__init__(api, guild, name)
+        self.member_ids = set()
+
+    async def add_user(self, user):
+        await self.api.request("PUT", f"/channels/{self.id}/thread-members/{user.id}")
+        self.member_ids.add(user.id)
+
+    async def remove_user(self, user):
+        await self.api.request("DELETE", f"/channels/{self.id}/thread-members/{user.id}")
+        self.member_ids.discard(user.id)
+
+    async def edit(self, **kwargs):
+        await self.api.request("PATCH", f"/channels/{self.id}")
+        return self
+
+    def get_partial_message(self, message_id: int):
+        message = FakeMessage(self.api, self)
+        message.id = message_id
+        return message
+
+
+def region_names() -> list[str]:
+    """Regions that are both a /prlhostleague choice and a region role."""
+    return [c.value for c in prl.REGION_CHOICES if c.value in prl.REGION_ROLES]
+
+
+class FakeGuild:
+    def __init__(self, api: FakeAPI):
+        self.id = next(_ids)
+        self.chunked = True
+        # The role names the bot really looks up: regions, ranks, tiers and strike bans
+        self.roles = [FakeRole(n) for n in (
+            region_names() + list(prl.RANK_NAMES.values())
+            + [prl.tier_role_name(t) for t in prl.TIER_NAMES] + list(prl.STRIKE_ROLES.values())
+        )]
+        self.me = FakeMember(api, self, "prlbot", [])
+        self.channels = {
+            cid: FakeChannel(api, self, name, cid) for cid, name in [
+                (MATCH_HOSTING_CHANNEL_ID, "match-hosting"),
+                (LOG_CHANNEL_ID, "league-logs"),
+                (LOBBY_CHANNEL_ID, "host-a-league"),
+            ]
+        }
+        self.text_channels = list(self.channels.values()) + [
+            FakeChannel(api, self, "host-strikes"), FakeChannel(api, self, "top-players")
+        ]
+        self.threads = {}
+        self.members = []
+        self.member_ids = {}
+
+    def get_channel(self, channel_id: int):
+        return self.channels.get(channel_id)
+
+    def get_thread(self, thread_id: int):
+        return self.threads.get(thread_id)
+
+    def get_member(self, user_id: int):
+        return self.member_ids.get(user_id)
+
+    def role(self, name: str) -> FakeRole:
+        return next(r for r in self.roles if r.name == name)
+
+
+class FakeResponse:
+    def __init__(self, interaction: "FakeInteraction"):
+        self.interaction = interaction
+        self._done = False
+        self.modal = None
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def _respond(self):
+        if self._done:
+            raise discord.InteractionResponded(self.interaction)
+        self._done = True
+        await self.interaction.api.request("POST", f"/interactions/{self.interaction.id}/callback")
+        self.interaction.responded_at = time.perf_counter()
+
+    async def send_message(self, *args, **kwargs):
+        await self._respond()
+
+    async def defer(self, **kwargs):
+        await self._respond()
+
+    async def send_modal(self, modal):
+        await self._respond()
+        self.modal = modal
+
+
+class FakeFollowup:
+    def __init__(self, interaction: "FakeInteraction"):
+        self.interaction = interaction
+
+    async def send(self, *args, **kwargs):
+        await self.interaction.api.request("POST", f"/webhooks/{self.interaction.id}/token")
+
+
+class FakeInteraction:
+    def __init__(self, api: FakeAPI, guild: FakeGuild, user: FakeMember, message=None):
+        self.api = api
+        self.id = next(_ids)
+        self.guild = guild
+        self.user = user
+        self.channel = guild.get_channel(LOBBY_CHANNEL_ID)
+        self.message = message
+        self.command = None
+        self.created_at = discord.utils.utcnow()
+        self.extras = {}
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.started = time.perf_counter()
+        self.responded_at = None
+
+
+# ——— Driving the handlers ———
+class Scenario:
+    def __init__(self, name: str, api: FakeAPI):
+        self.name = name
+        self.api = api
+        self.first_response_ms: list[float] = []
+        self.completion_ms: list[float] = []
+        self.errors = 0
+        self._calls = Counter(api.calls)
+        self._rate_limited = Counter(api.rate_limited)
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def record(self, interaction: FakeInteraction, ok: bool):
+        now = time.perf_counter()
+        self.completion_ms.append((now - interaction.started) * 1000)
+        if interaction.responded_at is not None:
+            self.first_response_ms.append((interaction.responded_at - interaction.started) * 1000)
+        if not ok:
+            self.errors += 1
+
+    def stop_clock(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    def close(self):
+        """Take the API call counts once background work has drained."""
+        self.calls = self.api.calls - self._calls
+        self.rate_limited = self.api.rate_limited - self._rate_limited
+
+
+async def run_command(scenario: Scenario, name: str, interaction: FakeInteraction, **options):
+    """Invoke a slash command the way CommandTree does: check, callback, then the completion/error hook."""
+    command = prl.bot.tree.get_command(name)
+    interaction.command = command
+    ok = True
+    try:
+        await prl.bot.tree.interaction_check(interaction)
+        await command.callback(interaction, **options)
+    except Exception as e:
+        ok = False
+        await prl.on_app_command_error(interaction, app_commands.CommandInvokeError(command, e))
+    else:
+        await prl.on_app_command_completion(interaction, command)
+    scenario.record(interaction, ok)
+
+
+async def click_join(scenario: Scenario, api: FakeAPI, guild: FakeGuild, user: FakeMember, hosting_msg: FakeMessage):
+    """Click the lobby's Join button, filling in the name modal if it pops up."""
+    interaction = FakeInteraction(api, guild, user, message=hosting_msg)
+    ok = True
+    try:
+        await hosting_msg.view.children[0].callback(interaction)
+        modal = interaction.response.modal
+        if modal is not None:
+            submit = FakeInteraction(api, guild, user)
+            modal.display_name._refresh_state(submit, {"value": f"ign_{user.name}"})
+            await modal.on_submit(submit)
+    except Exception as e:
+        ok = False
+        print(f"[join failed] {e!r}")
+    scenario.record(interaction, ok)
+
+
+async def settle(settle_seconds: float):
+    """Let debounced edits, log batches and queued REST calls drain."""
+    await asyncio.sleep(settle_seconds)
+    await prl.audit_log.flush()
+    while prl.rest.depth() or prl.rest._in_flight:
+        await asyncio.sleep(0.05)
+    await prl.user_store.flush()
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))]
+
+
+def report(scenario: Scenario, top_routes: int):
+    count = len(scenario.completion_ms)
+    print(f"\n=== {scenario.name}: {count} interactions in {scenario.elapsed:.2f}s "
+          f"({count / scenario.elapsed if scenario.elapsed else 0:.1f}/s), {scenario.errors} errors")
+    print(f"  first response  p50 {percentile(scenario.first_response_ms, 50):8.1f}ms"
+          f"  p99 {percentile(scenario.first_response_ms, 99):8.1f}ms")
+    print(f"  completion      p50 {percentile(scenario.completion_ms, 50):8.1f}ms"
+          f"  p99 {percentile(scenario.completion_ms, 99):8.1f}ms")
+    print(f"  API calls {sum(scenario.calls.values())}, 429s {sum(scenario.rate_limited.values())}")
+    for route, n in scenario.calls.most_common(top_routes):
+        limited = scenario.rate_limited.get(route, 0)
+        print(f"    {n:7d}  {route}" + (f"  ({limited} x 429)" if limited else ""))
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    api = FakeAPI(args.latency, args.jitter, args.rate_limit, args.retry_after, rng)
+    guild = FakeGuild(api)
+    regions = region_names()
+    ranks = list(prl.RANK_NAMES.values())
+    for i in range(args.users):
+        roles = [guild.role(rng.choice(regions))]
+        if rng.random() >= args.unranked:
+            roles += [guild.role(rng.choice(ranks)), guild.role(prl.tier_role_name(rng.choice(prl.TIER_NAMES)))]
+        member = FakeMember(api, guild, f"player{i}", roles)
+        guild.members.append(member)
+        guild.member_ids[member.id] = member
+        if rng.random() >= args.no_ign:
+            prl.user_data.setdefault(str(member.id), {})["display_name"] = f"ign_{member.name}"
+
+    if args.route_budget is not None:
+        prl.rest.route_budget = args.route_budget
+    if args.route_window is not None:
+        prl.rest.route_window = args.route_window
+    prl.bot.start_services()
+    hosts = guild.members[:args.hosts]
+    players = guild.members[args.hosts:]
+    moderators = hosts[:max(1, len(hosts) // 20)]
+    scenarios = []
+
+    async def burst(name: str, coros):
+        scenario = Scenario(name, api)
+        await asyncio.gather(*(coro(scenario) for coro in coros))
+        scenario.stop_clock()
+        await settle(args.settle)
+        scenario.close()
+        scenarios.append(scenario)
+        report(scenario, args.top_routes)
+
+    def host(member):
+        options = {"gametype": rng.choice(list(prl.player_caps)), "matchtype": rng.choice(list(prl.MATCHTYPE_DISPLAY)),
+                   "region": rng.choice(regions), "link": "https://example.invalid/lobby"}
+        return lambda s: run_command(s, "prlhostleague", FakeInteraction(api, guild, member), **options)
+    await burst("host", [host(m) for m in hosts])
+
+    # Join: everyone picks a random lobby at once; late clickers hit full or taken lobbies
+    hosting_msgs = guild.get_channel(MATCH_HOSTING_CHANNEL_ID).with_views
+    if hosting_msgs:
+        await burst("join", [
+            (lambda m, msg: lambda s: click_join(s, api, guild, m, msg))(m, rng.choice(hosting_msgs))
+            for m in players
+        ])
+
+    joined = [m for m in players if m.id in prl.player_games]
+    leavers = rng.sample(joined, int(len(joined) * args.leave_fraction))
+    await burst("leave", [
+        (lambda m: lambda s: run_command(s, "leave", FakeInteraction(api, guild, m)))(m) for m in leavers
+    ])
+
+    # Every host asks for a team split of what's left of their lobby
+    await burst("balance", [
+        (lambda m: lambda s: run_command(s, "balance", FakeInteraction(api, guild, m)))(m)
+        for m in hosts if m.id in prl.active_games
+    ])
+
+    # Moderators refresh #top-players at once: one index build, then unchanged or merged edits
+    await burst("topplayers", [
+        (lambda m: lambda s: run_command(s, "topplayers", FakeInteraction(api, guild, m)))(m) for m in moderators
+    ])
+
+    def strike(target, command):
+        options = {"user": target, "striketype": rng.choice(["host", "grief"]), "reason": "load test"}
+        return lambda s: run_command(s, command, FakeInteraction(api, guild, rng.choice(moderators)), **options)
+    targets = [rng.choice(guild.members) for _ in range(args.strikes)]
+    await burst("strike", [strike(t, "strike") for t in targets])
+    await burst("strikeremove", [strike(t, "strikeremove") for t in targets[:len(targets) // 2]])
+
+    def end_all(name):
+        return burst(name, [
+            (lambda m: lambda s: run_command(s, "endleague", FakeInteraction(api, guild, m)))(m)
+            for m in guild.members if m.id in prl.active_games
+        ])
+    await end_all("endleague")
+
+    # Everyone queues at once; lobbies open as buckets fill
+    def enqueue(member):
+        options = {"gametype": rng.choice(list(prl.player_caps)), "matchtype": rng.choice(list(prl.MATCHTYPE_DISPLAY))}
+        return lambda s: run_command(s, "queue", FakeInteraction(api, guild, member), **options)
+    await burst("queue", [enqueue(m) for m in guild.members])
+    print(f"  lobbies formed {len(prl.active_games)}, still queued {len(prl.matchmaker.entries)}")
+    await end_all("endleague (matched)")
+
+    await prl.bot.stop_services()
+    total = sum(len(s.completion_ms) for s in scenarios)
+    print(f"\nTotal: {total} interactions, {sum(api.calls.values())} API calls, "
+          f"{sum(api.rate_limited.values())} x 429, slow interactions logged: {prl.metrics.slow_interactions}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test prlbot's handlers against fake Discord objects.")
+    parser.add_argument("--users", type=int, default=2000, help="simulated members")
+    parser.add_argument("--hosts", type=int, default=None, help="members who host a lobby (default users/8)")
+    parser.add_argument("--strikes", type=int, default=200, help="strikes issued in the strike burst")
+    parser.add_argument("--leave-fraction", type=float, default=0.3, help="share of joined players who /leave")
+    parser.add_argument("--unranked", type=float, default=0.15, help="share of users without rank/tier roles")
+    parser.add_argument("--no-ign", type=float, default=0.2, help="share of users without a saved IGN (modal path)")
+    parser.add_argument("--latency", type=float, default=40.0, help="mean fake API latency in ms")
+    parser.add_argument("--jitter", type=float, default=20.0, help="+/- uniform latency jitter in ms")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="probability a call gets a 429 first")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="seconds a 429 makes the call wait")
+    parser.add_argument("--route-budget", type=int, default=None, help="override REST_ROUTE_BUDGET (calls per route window)")
+    parser.add_argument("--route-window", type=float, default=None, help="override REST_ROUTE_WINDOW in seconds")
+    parser.add_argument("--settle", type=float, default=2.0, help="seconds to let debounced work drain after each burst")
+    parser.add_argument("--top-routes", type=int, default=8, help="routes listed per scenario")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir", default=None, help="where the bot writes its files (default: a temp dir)")
+    args = parser.parse_args()
+    if args.hosts is None:
+        args.hosts = max(1, args.users // 8)
+
+    global prl
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    workdir = args.workdir or tempfile.mkdtemp(prefix="prl-loadtest-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    import prlbot
+    prl = prlbot
+    print(f"Working in {workdir}")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,285 +1,2596 @@
 import os
-
-TOKEN = os.getenv("DISCORD_TOKEN")
-if not TOKEN:
-    raise RuntimeError("DISCORD_TOKEN env var not found!")
 import aiohttp
 import asyncio
 import sys
 import discord
 import re
 import json
+import sqlite3
 from discord import app_commands
 from discord.ext import commands
 import datetime
 import asyncio
+import signal
+import time
+import bisect
+import hashlib
+import heapq
+import itertools
+import logging
+import threading
+import contextlib
+import contextvars
+import traceback
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
-from discord.ui import Modal, TextInput, View, button
+from discord.ui import Modal, TextInput, View
+
+
+# ——— Sharding ———
+# PRL_SHARD_COUNT=N runs as an AutoShardedBot. To spread shards over processes,
+# start one process per range with PRL_SHARD_IDS=0,1 / 2,3 ... and PRL_SHARED_STATE=1
+# so they all keep games, seats and strikes in the one SQLite file (prl_data.db).
+SHARD_COUNT = int(os.getenv("PRL_SHARD_COUNT", "0")) or None
+SHARD_IDS = [int(i) for i in os.getenv("PRL_SHARD_IDS", "").split(",") if i.strip()] or None
+SHARED_STATE = os.getenv("PRL_SHARED_STATE", "1" if SHARD_IDS else "0") == "1"
+# Tags this process's change-feed rows and names its private journal files
+PROCESS_NAME = "shards-" + "-".join(map(str, SHARD_IDS)) if SHARD_IDS else "main"
+PROCESS_TOKEN = f"{PROCESS_NAME}:{os.getpid()}:{int(time.time())}"
+
+
+def process_file(name: str) -> str:
+    """Per-process variant of a file only one process may append to and truncate."""
+    if not SHARD_IDS:
+        return name
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{PROCESS_NAME}{ext}"
+
+
+class PRLBot(commands.AutoShardedBot if SHARD_COUNT else commands.Bot):
+    def start_services(self):
+        """Background writers and publishers; also started by loadtest.py without a gateway."""
+        loop_watchdog.start()
+        asyncio.create_task(rank_journal.run_compactor())
+        asyncio.create_task(match_journal.run_compactor())
+        asyncio.create_task(audit_log.run())
+        asyncio.create_task(game_log.run())
+        asyncio.create_task(strike_timers.run())
+        if METRICS_PORT:
+            self.metrics_server = start_metrics_server(METRICS_HOST, int(METRICS_PORT))
+            asyncio.create_task(metrics.run_publisher())
+
+    async def stop_services(self):
+        loop_watchdog.stop()
+        await audit_log.close()
+        await game_log.snapshot()
+        await rank_journal.compact()
+        await match_journal.compact()
+        await user_store.close()
+        if getattr(self, "metrics_server", None):
+            self.metrics_server.shutdown()
+
+    async def setup_hook(self):
+        self.start_services()
+
+        # One stateless handler serves the Join button of every lobby, restored ones included
+        self.add_dynamic_items(JoinLeagueButton, LegacyJoinButton)
+        if active_games:
+            print(f"Restored {len(active_games)} active league(s).")
+
+        # setup_hook runs once per process, unlike on_ready; one shard process syncs for all
+        if not SHARD_IDS or 0 in SHARD_IDS:
+            await sync_commands(self.tree)
+        # Make sure pending writes hit the disk when the host stops the process
+        try:
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGTERM, lambda: asyncio.create_task(self.close())
+            )
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    async def close(self):
+        await self.stop_services()
+        await super().close()
+
+
+# ——— Member cache policy ———
+# "full": every intent, every member chunked at startup and kept in memory (old behaviour)
+# "roles": no presences, no startup chunking and no caching of members as they
+#          join or change; the leaderboard index build caches holders of
+#          member_cache_roles() (the rank roles) and drops them again when
+#          they lose those roles. Everyone else goes through resolve_member
+#          (guild cache, then MemberLRU, then one fetch)
+MEMBER_CACHE_POLICY = os.getenv("PRL_MEMBER_CACHE", "roles").lower()
+MEMBER_LRU_SIZE = int(os.getenv("PRL_MEMBER_LRU_SIZE", "2000"))
+
+
+def build_client_options() -> dict:
+    options = {}
+    if SHARD_COUNT:
+        options["shard_count"] = SHARD_COUNT
+        if SHARD_IDS:
+            options["shard_ids"] = SHARD_IDS
+    if MEMBER_CACHE_POLICY == "full":
+        return {**options, "intents": discord.Intents.all()}
+    intents = discord.Intents.all()
+    intents.presences = False  # nothing reads presences; they dominate gateway traffic and RSS
+    return {
+        **options,
+        "intents": intents,
+        "chunk_guilds_at_startup": False,
+        # from_intents() would turn on "joined" and cache every member seen; discord.py
+        # never dispatches member_update for uncached members anyway, so nothing is lost
+        "member_cache_flags": discord.MemberCacheFlags.none(),
+    }
+
 
+class PRLCommandTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        sync_shared_state()
+        # Runs in the same task as the command, so the trace context reaches its calls
+        if interaction.command:
+            start_trace(f"/{interaction.command.qualified_name}", interaction)
+        return True
+
+
+bot = PRLBot(command_prefix="!", tree_cls=PRLCommandTree, **build_client_options())
+
+
+# ——— Metrics ———
+# Set PRL_METRICS_PORT to serve Prometheus text format on http://PRL_METRICS_HOST:port/metrics
+METRICS_PORT = os.getenv("PRL_METRICS_PORT")
+METRICS_HOST = os.getenv("PRL_METRICS_HOST", "127.0.0.1")
+METRICS_PUBLISH_INTERVAL = 1.0
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0)
+FLUSH_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+LOOP_LAG_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+
+class Histogram:
+    """Cumulative-bucket histogram; only ever touched from the event loop."""
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> tuple:
+        return (self.buckets, tuple(self.counts), self.sum, self.count)
+
+
+class Metrics:
+    """Counters the handlers update in place, published as immutable snapshots.
+
+    A loop task copies everything into a fresh dict every second and swaps
+    ``latest`` to it; the HTTP thread only ever reads that reference, so a
+    scrape never takes a lock or touches live state.
+    """
+
+    def __init__(self):
+        self.commands: dict[tuple[str, str], int] = {}   # (command, status) -> count
+        self.command_latency: dict[str, Histogram] = {}
+        self.flush_seconds = Histogram(FLUSH_BUCKETS)
+        self.discord_429: dict[str, int] = {}
+        self.slow_interactions = 0
+        self.shared_conflicts = 0
+        self.loop_lag = Histogram(LOOP_LAG_BUCKETS)
+        self.loop_stalls = 0
+        self.last_stall_seconds = 0.0
+        self.latest: dict = {}
+
+    def observe_command(self, name: str, status: str, seconds: float):
+        key = (name, status)
+        self.commands[key] = self.commands.get(key, 0) + 1
+        self.command_latency.setdefault(name, Histogram(LATENCY_BUCKETS)).observe(seconds)
+
+    def snapshot(self) -> dict:
+        latency = bot.latency
+        return {
+            "commands": dict(self.commands),
+            "command_latency": {name: h.snapshot() for name, h in self.command_latency.items()},
+            "flush_seconds": self.flush_seconds.snapshot(),
+            "discord_429": dict(self.discord_429),
+            "slow_interactions": self.slow_interactions,
+            "shared_conflicts": self.shared_conflicts,
+            "loop_lag": self.loop_lag.snapshot(),
+            "loop_stalls": self.loop_stalls,
+            "last_stall_seconds": self.last_stall_seconds,
+            "gateway_latency": latency if latency == latency and latency != float("inf") else None,
+            "active_games": len(active_games),
+            "active_players": len(player_games),
+            "queued_players": len(matchmaker.entries),
+            "strike_timers": len(strike_timers.heap),
+            "strikes_expired": strike_timers.stats["expired"],
+            "rest_calls": dict(rest.stats["calls"]),
+            "rest_errors": dict(rest.stats["errors"]),
+            "rest_queue_depth": [rest.depth(p) for p in range(len(PRIORITY_NAMES))],
+            "rest_wait": [dict(w) for w in rest.stats["wait"]],
+            "store": dict(user_store.stats),
+            "log_queue_depth": audit_log.depth(),
+            "log": dict(audit_log.stats),
+        }
+
+    async def run_publisher(self):
+        while True:
+            try:
+                self.latest = self.snapshot()
+            except Exception as e:
+                print(f"[Error publishing metrics] {e}")
+            await asyncio.sleep(METRICS_PUBLISH_INTERVAL)
+
+
+metrics = Metrics()
+
+
+class RateLimitLogCounter(logging.Handler):
+    """Counts the 429s discord.py retries internally, which never reach our callers."""
+
+    PATTERN = re.compile(r"^We are being rate limited\. (\S+) (\S+) responded with 429")
+
+    def emit(self, record: logging.LogRecord):
+        match = self.PATTERN.match(record.getMessage())
+        if match:
+            path = re.sub(r"/[0-9]{15,21}", "/:id", match.group(2).split("/api/v10", 1)[-1])
+            route = f"{match.group(1)} {path}"
+            metrics.discord_429[route] = metrics.discord_429.get(route, 0) + 1
+
+
+logging.getLogger("discord.http").addHandler(RateLimitLogCounter(level=logging.WARNING))
+
+
+def _label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _by_route_label(counts: dict) -> dict:
+    """Fold snowflakes out of route names so each route is one series, not one per thread."""
+    folded = {}
+    for route, n in counts.items():
+        route = re.sub(r"[0-9]{15,21}", "{id}", route)  # thread.members:{id}
+        folded[route] = folded.get(route, 0) + n
+    return folded
+
+
+def _render_histogram(lines: list, name: str, labels: str, snap: tuple):
+    buckets, counts, total, count = snap
+    running = 0
+    sep = "," if labels else ""
+    for bound, n in zip(buckets, counts):
+        running += n
+        lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {running}')
+    lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {count}')
+    braced = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{braced} {total}")
+    lines.append(f"{name}_count{braced} {count}")
+
+
+def render_prometheus(snap: dict) -> str:
+    """Prometheus text exposition of a metrics snapshot (runs on the HTTP thread)."""
+    lines = []
+    if not snap:
+        return ""
+    lines.append("# TYPE prl_command_invocations_total counter")
+    for (name, status), n in sorted(snap["commands"].items()):
+        lines.append(f'prl_command_invocations_total{{command="{_label(name)}",status="{status}"}} {n}')
+    lines.append("# TYPE prl_command_latency_seconds histogram")
+    for name, hist in sorted(snap["command_latency"].items()):
+        _render_histogram(lines, "prl_command_latency_seconds", f'command="{_label(name)}"', hist)
+
+    lines.append("# TYPE prl_slow_interactions_total counter")
+    lines.append(f"prl_slow_interactions_total {snap['slow_interactions']}")
+    lines.append("# TYPE prl_shared_state_conflicts_total counter")
+    lines.append(f"prl_shared_state_conflicts_total {snap['shared_conflicts']}")
+    lines.append("# TYPE prl_event_loop_lag_seconds histogram")
+    _render_histogram(lines, "prl_event_loop_lag_seconds", "", snap["loop_lag"])
+    lines.append("# TYPE prl_event_loop_stalls_total counter")
+    lines.append(f"prl_event_loop_stalls_total {snap['loop_stalls']}")
+    lines.append("# TYPE prl_event_loop_last_stall_seconds gauge")
+    lines.append(f"prl_event_loop_last_stall_seconds {snap['last_stall_seconds']}")
+    lines.append("# TYPE prl_active_games gauge")
+    lines.append(f"prl_active_games {snap['active_games']}")
+    lines.append("# TYPE prl_active_players gauge")
+    lines.append(f"prl_active_players {snap['active_players']}")
+    lines.append("# TYPE prl_queued_players gauge")
+    lines.append(f"prl_queued_players {snap['queued_players']}")
+    lines.append("# TYPE prl_strike_timers gauge")
+    lines.append(f"prl_strike_timers {snap['strike_timers']}")
+    lines.append("# TYPE prl_strikes_expired_total counter")
+    lines.append(f"prl_strikes_expired_total {snap['strikes_expired']}")
+    if snap["gateway_latency"] is not None:
+        lines.append("# TYPE prl_gateway_latency_seconds gauge")
+        lines.append(f"prl_gateway_latency_seconds {snap['gateway_latency']}")
+
+    lines.append("# TYPE prl_rest_calls_total counter")
+    for route, n in sorted(_by_route_label(snap["rest_calls"]).items()):
+        lines.append(f'prl_rest_calls_total{{route="{_label(route)}"}} {n}')
+    lines.append("# TYPE prl_rest_errors_total counter")
+    for route, n in sorted(_by_route_label(snap["rest_errors"]).items()):
+        lines.append(f'prl_rest_errors_total{{route="{_label(route)}"}} {n}')
+    lines.append("# TYPE prl_discord_rate_limited_total counter")
+    for route, n in sorted(snap["discord_429"].items()):
+        lines.append(f'prl_discord_rate_limited_total{{route="{_label(route)}"}} {n}')
+    priorities = [f'priority="{name}"' for name in PRIORITY_NAMES]
+    lines.append("# TYPE prl_rest_queue_depth gauge")
+    for label, depth in zip(priorities, snap["rest_queue_depth"]):
+        lines.append(f"prl_rest_queue_depth{{{label}}} {depth}")
+    lines.append("# TYPE prl_rest_wait_seconds summary")
+    for label, wait in zip(priorities, snap["rest_wait"]):
+        lines.append(f"prl_rest_wait_seconds_sum{{{label}}} {wait['total_ms'] / 1000}")
+        lines.append(f"prl_rest_wait_seconds_count{{{label}}} {wait['count']}")
+    lines.append("# TYPE prl_rest_wait_seconds_max gauge")
+    for label, wait in zip(priorities, snap["rest_wait"]):
+        lines.append(f"prl_rest_wait_seconds_max{{{label}}} {wait['max_ms'] / 1000}")
+
+    lines.append("# TYPE prl_persistence_flush_seconds histogram")
+    _render_histogram(lines, "prl_persistence_flush_seconds", "", snap["flush_seconds"])
+    store = snap["store"]
+    lines.append("# TYPE prl_persistence_writes_requested_total counter")
+    lines.append(f"prl_persistence_writes_requested_total {store['writes_requested']}")
+    lines.append("# TYPE prl_persistence_writes_merged_total counter")
+    lines.append(f"prl_persistence_writes_merged_total {store['writes_merged']}")
+    lines.append("# TYPE prl_persistence_flush_errors_total counter")
+    lines.append(f"prl_persistence_flush_errors_total {store['flush_errors']}")
+
+    lines.append("# TYPE prl_log_queue_depth gauge")
+    lines.append(f"prl_log_queue_depth {snap['log_queue_depth']}")
+    for key in ("sent_embeds", "dropped", "spilled"):
+        lines.append(f"# TYPE prl_log_{key}_total counter")
+        lines.append(f"prl_log_{key}_total {snap['log'][key]}")
+    return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(host: str, port: int):
+    """Serve /metrics from a daemon thread; Flask is only needed when this is enabled."""
+    try:
+        from flask import Flask, Response
+        from werkzeug.serving import make_server
+    except ImportError:
+        print("[Metrics] Flask is not installed; metrics endpoint disabled.")
+        return None
+
+    app = Flask("prlbot-metrics")
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)  # no access log line per scrape
+
+    @app.route("/metrics")
+    def metrics_endpoint():
+        return Response(render_prometheus(metrics.latest), mimetype="text/plain; version=0.0.4")
+
+    server = make_server(host, port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="prl-metrics", daemon=True).start()
+    print(f"📈 Metrics on http://{host}:{port}/metrics")
+    return server
+
+
+# ——— Event loop watchdog ———
+LOOP_TICK_SECONDS = 0.1
+# A loop that hasn't ticked for this long is stalled; its stack gets captured
+LOOP_STALL_SECONDS = float(os.getenv("PRL_LOOP_STALL_SECONDS", "0.5"))
+LOOP_STALL_FILE = "loop_stalls.jsonl"
+
+
+class LoopWatchdog:
+    """Measures event loop lag and catches whatever is blocking it in the act.
+
+    A loop task ticks every ``LOOP_TICK_SECONDS`` and records how late each
+    tick was. A daemon thread watches the tick timestamp; once it is older
+    than ``LOOP_STALL_SECONDS`` the thread grabs the loop thread's current
+    stack with ``sys._current_frames()``, i.e. the sync call that's holding
+    the loop. The stall is printed right away (so a hard hang still shows up)
+    and, once the loop is back, counted in metrics and appended to
+    ``LOOP_STALL_FILE`` with its full duration.
+    """
+
+    def __init__(self, tick: float = LOOP_TICK_SECONDS, threshold: float = LOOP_STALL_SECONDS):
+        self.tick = tick
+        self.threshold = threshold
+        self._last_tick = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._stall: Optional[dict] = None  # set by the watcher thread, consumed by the loop
+        self._stop = threading.Event()
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stop.clear()
+        asyncio.create_task(self._ticker())
+        threading.Thread(target=self._watch, name="prl-loop-watchdog", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    async def _ticker(self):
+        while not self._stop.is_set():
+            before = time.monotonic()
+            await asyncio.sleep(self.tick)
+            now = time.monotonic()
+            self._last_tick = now
+            metrics.loop_lag.observe(max(0.0, now - before - self.tick))
+            stall, self._stall = self._stall, None
+            if stall:
+                self._report(stall, now - stall["since"])
+
+    def _watch(self):
+        while not self._stop.wait(self.tick):
+            last = self._last_tick
+            blocked = time.monotonic() - last
+            if blocked < self.threshold or (self._stall is not None and self._stall["since"] == last):
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = self._format_stack(frame) if frame else "<loop thread not found>"
+            self._stall = {"since": last, "stack": stack}
+            print(f"[Loop stall] event loop blocked for {blocked:.2f}s so far, at:\n{stack}")
+
+    @staticmethod
+    def _format_stack(frame) -> str:
+        # Drop the asyncio runner frames above the callback that is blocking
+        entries = traceback.extract_stack(frame)
+        asyncio_dir = os.path.dirname(asyncio.__file__)
+        start = max((i + 1 for i, e in enumerate(entries) if e.filename.startswith(asyncio_dir)), default=0)
+        return "".join(traceback.format_list(entries[start:] or entries))
+
+    def _report(self, stall: dict, duration: float):
+        metrics.loop_stalls += 1
+        metrics.last_stall_seconds = duration
+        print(f"[Loop stall] event loop resumed after {duration:.2f}s")
+        record = {
+            "ts": datetime.datetime.now().isoformat(timespec="seconds"),
+            "seconds": round(duration, 3),
+            "stack": stall["stack"],
+        }
+        user_store.submit(_append_line, LOOP_STALL_FILE, json.dumps(record) + "\n")
+
+
+loop_watchdog = LoopWatchdog()
+
+
+# ——— Interaction tracing ———
+# PRL_TRACE=1 records a span breakdown for every slash command, button and modal
+TRACE_ENABLED = os.getenv("PRL_TRACE") == "1"
+SLOW_INTERACTION_SECONDS = float(os.getenv("PRL_SLOW_SECONDS", "2.0"))
+SLOW_LOG_FILE = "slow_interactions.jsonl"
+
+current_trace: contextvars.ContextVar[Optional["InteractionTrace"]] = contextvars.ContextVar("prl_trace", default=None)
+
+
+class InteractionTrace:
+    """Timeline of one interaction: time to first response plus one span per API call or write."""
+
+    def __init__(self, name: str, interaction: discord.Interaction):
+        self.name = name
+        self.interaction_id = interaction.id
+        self.user_id = interaction.user.id if interaction.user else None
+        self.started = time.perf_counter()
+        self.first_response_ms: Optional[float] = None
+        self.spans: list[dict] = []
+        self.finished = False
+
+    def add_span(self, name: str, start: float, end: float, **extra):
+        if self.finished:
+            return  # background work that outlived the interaction
+        self.spans.append({
+            "name": name,
+            "start_ms": round((start - self.started) * 1000, 2),
+            "duration_ms": round((end - start) * 1000, 2),
+            **extra,
+        })
+
+    def mark_response(self):
+        if self.first_response_ms is None:
+            self.first_response_ms = round((time.perf_counter() - self.started) * 1000, 2)
+
+    def finish(self, status: str):
+        if self.finished:
+            return
+        self.finished = True
+        total = time.perf_counter() - self.started
+        if total < SLOW_INTERACTION_SECONDS:
+            return
+        metrics.slow_interactions += 1
+        record = {
+            "ts": datetime.datetime.now().isoformat(timespec="seconds"),
+            "interaction": self.name,
+            "interaction_id": self.interaction_id,
+            "user_id": self.user_id,
+            "status": status,
+            "total_ms": round(total * 1000, 2),
+            "first_response_ms": self.first_response_ms,
+            "spans": self.spans,
+        }
+        print(f"[Slow interaction] {self.name} took {record['total_ms']}ms (first response {self.first_response_ms}ms)")
+        user_store.submit(_append_line, SLOW_LOG_FILE, json.dumps(record) + "\n")
+
+
+def _append_line(path: str, line: str):
+    with open(path, "a") as f:
+        f.write(line)
+
+
+def start_trace(name: str, interaction: discord.Interaction) -> Optional[InteractionTrace]:
+    if not TRACE_ENABLED:
+        return None
+    trace = InteractionTrace(name, interaction)
+    interaction.extras["trace"] = trace
+    current_trace.set(trace)
+    return trace
+
+
+def finish_trace(interaction: discord.Interaction, status: str):
+    trace = interaction.extras.get("trace")
+    if trace:
+        trace.finish(status)
+
+
+@contextlib.asynccontextmanager
+async def traced_interaction(name: str, interaction: discord.Interaction):
+    """Trace a component/modal callback from start to return."""
+    trace = start_trace(name, interaction)
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        if trace:
+            trace.finish(status)
+
+
+@contextlib.contextmanager
+def span(name: str, **extra):
+    """Record a span on the current interaction's trace (no-op outside one)."""
+    trace = current_trace.get()
+    if trace is None or trace.finished:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, start, time.perf_counter(), **extra)
+
+
+# ——— Outbound REST scheduler ———
+PRIORITY_INTERACTION = 0  # interaction responses/followups (3s deadline)
+PRIORITY_STATE = 1        # thread creation, membership, roles, lobby messages
+PRIORITY_COSMETIC = 2     # footer and leaderboard edits
+PRIORITY_LOG = 3          # audit log posts
+PRIORITY_NAMES = ["interaction", "state", "cosmetic", "log"]
+REST_MAX_IN_FLIGHT = 8    # concurrent non-interaction calls
+REST_ROUTE_BUDGET = 5     # calls per route...
+REST_ROUTE_WINDOW = 5.0   # ...per this many seconds (Discord's usual per-channel bucket)
+
+
+class RestScheduler:
+    """Single gate for the bot's outbound Discord API calls.
+
+    Interaction responses go straight out. Everything else waits in a queue
+    per priority and is started highest priority first, within a cap on calls
+    in flight and a per-route budget. A burst of log posts can therefore
+    never push a slash command reply past its deadline. Calls on one route
+    start in the order they were queued.
+    """
+
+    def __init__(self, max_in_flight: int = REST_MAX_IN_FLIGHT,
+                 route_budget: int = REST_ROUTE_BUDGET, route_window: float = REST_ROUTE_WINDOW):
+        self.max_in_flight = max_in_flight
+        self.route_budget = route_budget
+        self.route_window = route_window
+        self._queues: list[deque] = [deque() for _ in PRIORITY_NAMES]
+        self._recent: dict[str, deque] = {}
+        self._last_sweep = 0.0
+        self._in_flight = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # Keyed by route template ("thread.members"), not the per-thread route,
+        # so they stay bounded however many lobbies come and go
+        self.stats = {
+            "calls": {},          # route template -> calls started
+            "errors": {},         # route template -> HTTP errors
+            "rate_limited": {},   # route template -> 429s that reached us
+            "wait": [{"count": 0, "total_ms": 0.0, "max_ms": 0.0} for _ in PRIORITY_NAMES],
+        }
+
+    def depth(self, priority: Optional[int] = None) -> int:
+        if priority is not None:
+            return len(self._queues[priority])
+        return sum(len(q) for q in self._queues)
+
+    async def call(self, priority: int, route: str, fn, *args, **kwargs):
+        """Run ``await fn(*args, **kwargs)`` once the scheduler lets it through."""
+        with span(f"{PRIORITY_NAMES[priority]}:{route}"):
+            if priority == PRIORITY_INTERACTION:
+                self._record_start(priority, route, time.perf_counter())
+                result = await self._run(route, fn, args, kwargs)
+                trace = current_trace.get()
+                if trace:
+                    trace.mark_response()
+                return result
+
+            future = asyncio.get_running_loop().create_future()
+            self._queues[priority].append((route, time.perf_counter(), future, fn, args, kwargs))
+            if self._task is None or self._task.done():
+                self._task = asyncio.create_task(self._dispatch_loop())
+            self._wakeup.set()
+            return await future
+
+    @staticmethod
+    def _template(route: str) -> str:
+        """``thread.members:123`` -> ``thread.members``; the id only matters for budgeting."""
+        return route.partition(":")[0]
+
+    async def _run(self, route: str, fn, args, kwargs):
+        try:
+            return await fn(*args, **kwargs)
+        except discord.HTTPException as e:
+            template = self._template(route)
+            self.stats["errors"][template] = self.stats["errors"].get(template, 0) + 1
+            if e.status == 429:
+                self.stats["rate_limited"][template] = self.stats["rate_limited"].get(template, 0) + 1
+            raise
+
+    def _record_start(self, priority: int, route: str, enqueued: float):
+        template = self._template(route)
+        self.stats["calls"][template] = self.stats["calls"].get(template, 0) + 1
+        waited = (time.perf_counter() - enqueued) * 1000
+        wait = self.stats["wait"][priority]
+        wait["count"] += 1
+        wait["total_ms"] += waited
+        wait["max_ms"] = max(wait["max_ms"], waited)
+
+    def _route_delay(self, route: str, now: float) -> float:
+        recent = self._recent.get(route)
+        if recent is None:
+            return 0.0
+        while recent and recent[0] <= now - self.route_window:
+            recent.popleft()
+        if not recent:
+            del self._recent[route]  # routes of ended lobbies don't linger
+            return 0.0
+        if len(recent) < self.route_budget:
+            return 0.0
+        return recent[0] + self.route_window - now
+
+    async def _complete(self, priority: int, item):
+        route, enqueued, future, fn, args, kwargs = item
+        self._record_start(priority, route, enqueued)
+        try:
+            result = await self._run(route, fn, args, kwargs)
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+
+    def _dispatch(self) -> Optional[float]:
+        """Start whatever may run now; returns seconds until a blocked route frees up."""
+        now = time.monotonic()
+        if now - self._last_sweep > self.route_window:
+            # Routes of ended lobbies never come back through _route_delay
+            self._last_sweep = now
+            for route in [r for r, recent in self._recent.items() if recent[-1] <= now - self.route_window]:
+                del self._recent[route]
+        soonest = None
+        for priority, queue in enumerate(self._queues):
+            kept, blocked = deque(), set()
+            while queue:
+                item = queue.popleft()
+                route, future = item[0], item[2]
+                if future.done():
+                    continue  # caller went away
+                if self._in_flight >= self.max_in_flight or route in blocked:
+                    kept.append(item)
+                    continue
+                delay = self._route_delay(route, now)
+                if delay > 0:
+                    blocked.add(route)
+                    kept.append(item)
+                    soonest = delay if soonest is None else min(soonest, delay)
+                    continue
+                self._recent.setdefault(route, deque()).append(now)
+                self._in_flight += 1
+                task = asyncio.create_task(self._complete(priority, item))
+                task.add_done_callback(self._release)
+            self._queues[priority] = kept
+        return soonest
+
+    def _release(self, _task):
+        self._in_flight -= 1
+        self._wakeup.set()
+
+    async def _dispatch_loop(self):
+        timeout = None
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            timeout = self._dispatch()
+
+
+rest = RestScheduler()
+
+
+async def send_response(interaction: discord.Interaction, *args, **kwargs):
+    return await rest.call(PRIORITY_INTERACTION, "interaction", interaction.response.send_message, *args, **kwargs)
+
+async def send_followup(interaction: discord.Interaction, *args, **kwargs):
+    return await rest.call(PRIORITY_INTERACTION, "interaction", interaction.followup.send, *args, **kwargs)
+
+async def defer_response(interaction: discord.Interaction, **kwargs):
+    return await rest.call(PRIORITY_INTERACTION, "interaction", interaction.response.defer, **kwargs)
+
+async def send_modal(interaction: discord.Interaction, modal: Modal):
+    return await rest.call(PRIORITY_INTERACTION, "interaction", interaction.response.send_modal, modal)
+
+
+# ——— Persistence ———
+USER_DATA_FILE = "user_data_prl.json"
+SQLITE_FILE = "prl_data.db"
+# "json" keeps the single user_data_prl.json file, "sqlite" stores rows in SQLITE_FILE
+# (always sqlite with PRL_SHARED_STATE)
+STORAGE_BACKEND = os.getenv("PRL_STORAGE", "json").lower()
+SAVE_DEBOUNCE_SECONDS = 2.0
+# How long the writer thread waits on another process's transaction
+SHARED_BUSY_TIMEOUT_MS = 2000
+# SharedState runs on the event loop: give up quickly and report "try again"
+# instead of stalling every other interaction behind a lock
+SHARED_LOOP_BUSY_TIMEOUT_MS = 50
+
+
+def _copy_records(obj):
+    """Cheap structural copy of the JSON tree so it can be serialized off the loop."""
+    if isinstance(obj, dict):
+        return {k: _copy_records(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_copy_records(v) for v in obj]
+    return obj
+
+
+_MISSING = object()
+
+
+def merge_records(base, local, current, counters: bool = False):
+    """Apply what changed between ``base`` and ``local`` on top of ``current``.
+
+    For shard processes writing the same profile row: ``base`` is the row as
+    this process last read or wrote it, ``current`` is the row now. Keys this
+    process didn't touch keep the other processes' values, and counters under
+    "stats" add this process's increments instead of replacing the total.
+    """
+    if local == base:
+        return current
+    if isinstance(local, dict) and isinstance(current, dict):
+        base = base if isinstance(base, dict) else {}
+        merged = dict(current)
+        for key in set(local) | set(base):
+            ours, theirs = local.get(key, _MISSING), base.get(key, _MISSING)
+            if ours == theirs:
+                continue
+            if ours is _MISSING:
+                merged.pop(key, None)
+            else:
+                merged[key] = merge_records(
+                    None if theirs is _MISSING else theirs, ours,
+                    merged.get(key), counters or key == "stats"
+                )
+        return merged
+    if counters and type(local) is int and type(current) is int:
+        return current + local - (base if type(base) is int else 0)
+    return local
+
+
+def read_journal_lines(path: str) -> list[str]:
+    """Complete lines of an append-only JSONL file, for replay at startup.
+
+    A crash mid-append leaves a last line without its newline. It is cut off
+    here, before anything else is appended, so the next record doesn't end
+    up glued to the fragment (and lost with it on the following restore).
+    """
+    try:
+        with open(path, "rb+") as f:
+            content = f.read()
+            end = content.rfind(b"\n") + 1
+            if end < len(content):
+                f.truncate(end)
+                print(f"Dropped a torn final line from {path}.")
+    except FileNotFoundError:
+        return []
+    return content[:end].decode().splitlines(keepends=True)
+
+
+class JsonBackend:
+    """Whole-file backend: every flush rewrites the JSON document atomically.
+
+    Only the dirty users are copied on the loop. The writer thread keeps
+    every user's record already serialized and assembles the file from
+    those, so a clean user costs a string join instead of a copy and a dump.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # user id -> serialized record; only touched by load() and the writer thread
+        self._profiles: dict[str, str] = {}
+        self._strikes: dict[str, str] = {}
+
+    def load(self) -> dict:
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        self._profiles = {k: json.dumps(v) for k, v in data.items() if k != "strikes"}
+        self._strikes = {k: json.dumps(v) for k, v in data.get("strikes", {}).items()}
+        return data
+
+    def prepare(self, data: dict, dirty: set[str]):
+        strikes = data.get("strikes", {})
+        return [
+            (uid, _copy_records(data.get(uid)), _copy_records(strikes.get(uid)))
+            for uid in dirty if uid != "strikes"
+        ]
+
+    @staticmethod
+    def _members(fragments: dict[str, str]) -> list[str]:
+        return [f"{json.dumps(uid)}: {fragment}" for uid, fragment in fragments.items()]
+
+    def write(self, rows):
+        for uid, profile, strike in rows:
+            for fragments, record in ((self._profiles, profile), (self._strikes, strike)):
+                if record is None:
+                    fragments.pop(uid, None)
+                else:
+                    fragments[uid] = json.dumps(record)
+        # One user per line keeps the file readable without re-indenting every record
+        strikes = '"strikes": {\n  ' + ",\n  ".join(self._members(self._strikes)) + "\n}"
+        payload = "{\n" + ",\n".join(self._members(self._profiles) + [strikes]) + "\n}\n"
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def committed(self, rows):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend:
+    """Row-level backend: profiles, ranks and strikes live in their own tables.
+
+    The in-memory ``user_data`` keeps its JSON shape so handlers don't change;
+    a flush only upserts the rows of the users that were marked dirty.
+
+    When shard processes share the file, a flush can't just upsert its copy:
+    another process may have changed the row since this one read it. ``synced``
+    keeps each profile as this process last read or wrote it, and the write
+    merges only what changed since then into the row as it is now.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (
+            key   TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS profiles (
+            user_id      TEXT PRIMARY KEY,
+            display_name TEXT,
+            extra        TEXT
+        );
+        CREATE TABLE IF NOT EXISTS ranks (
+            user_id TEXT PRIMARY KEY,
+            rank    TEXT NOT NULL,
+            tier    TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_ranks_rank ON ranks(rank, tier);
+        CREATE TABLE IF NOT EXISTS strikes (
+            user_id  TEXT PRIMARY KEY,
+            host     INTEGER NOT NULL DEFAULT 0,
+            grief    INTEGER NOT NULL DEFAULT 0,
+            expires  TEXT,
+            guild_id INTEGER
+        );
+    """
+    # Columns added to tables of databases created by older versions
+    ADDED_COLUMNS = (("strikes", "expires", "TEXT"), ("strikes", "guild_id", "INTEGER"))
+    # Extra tables when several shard processes share the file (see SharedState)
+    SHARED_SCHEMA = """
+        CREATE TABLE IF NOT EXISTS games (
+            host_id INTEGER PRIMARY KEY,
+            data    TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS game_players (
+            user_id INTEGER PRIMARY KEY,
+            host_id INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_game_players_host ON game_players(host_id);
+        CREATE TABLE IF NOT EXISTS changes (
+            seq    INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind   TEXT NOT NULL,
+            key    TEXT NOT NULL,
+            origin TEXT NOT NULL,
+            ts     REAL NOT NULL
+        );
+    """
+    PROFILE_KEYS = ("display_name", "rank", "tier")
+
+    def __init__(self, path: str, json_path: Optional[str] = None, shared: bool = False):
+        self.path = path
+        self.json_path = json_path
+        self.shared = shared
+        # user id -> profile as last read from or written to the database (shared
+        # mode only); only touched on the loop
+        self.synced: dict[str, dict] = {}
+        # Opened on the main thread, then only used by the store's writer thread
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self.upgrade_schema(self.conn)
+        if shared:
+            self.conn.execute(f"PRAGMA busy_timeout={SHARED_BUSY_TIMEOUT_MS}")
+            self.conn.executescript(self.SHARED_SCHEMA)
+
+    def load(self) -> dict:
+        if self.json_path:
+            migrate_json_to_sqlite(self.json_path, self)
+        data = self.read_users(self.conn)
+        if self.shared:
+            self.synced = {uid: _copy_records(p) for uid, p in data.items() if uid != "strikes"}
+        return data
+
+    @classmethod
+    def upgrade_schema(cls, conn: sqlite3.Connection):
+        for table, column, kind in cls.ADDED_COLUMNS:
+            columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                try:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
+                except sqlite3.OperationalError:
+                    pass  # another shard process added it first
+
+    @staticmethod
+    def read_users(conn: sqlite3.Connection, user_ids: Optional[list[str]] = None) -> dict:
+        """Rows in the in-memory ``user_data`` shape, for everyone or just ``user_ids``."""
+        where, params = "", ()
+        if user_ids is not None:
+            where, params = f" WHERE user_id IN ({','.join('?' * len(user_ids))})", tuple(user_ids)
+        data: dict = {"strikes": {}}
+        for user_id, display_name, extra in conn.execute(
+            "SELECT user_id, display_name, extra FROM profiles" + where, params
+        ):
+            profile = json.loads(extra) if extra else {}
+            if display_name is not None:
+                profile["display_name"] = display_name
+            data[user_id] = profile
+        for user_id, rank, tier in conn.execute("SELECT user_id, rank, tier FROM ranks" + where, params):
+            profile = data.setdefault(user_id, {})
+            profile["rank"] = rank
+            profile["tier"] = tier
+        for user_id, host, grief, expires, guild_id in conn.execute(
+            "SELECT user_id, host, grief, expires, guild_id FROM strikes" + where, params
+        ):
+            strike = {"host": host, "grief": grief}
+            if expires:
+                strike["expires"] = json.loads(expires)
+            if guild_id is not None:
+                strike["guild_id"] = guild_id
+            data["strikes"][user_id] = strike
+        return data
+
+    def prepare(self, data: dict, dirty: set[str]):
+        strikes = data.get("strikes", {})
+        return [
+            (uid, _copy_records(data.get(uid)), _copy_records(strikes.get(uid)), self.synced.get(uid))
+            for uid in dirty if uid != "strikes"
+        ]
+
+    def write(self, rows):
+        if not self.shared:
+            with self.conn:
+                for uid, profile, strike, _ in rows:
+                    self._write_user(uid, profile, strike)
+            return
+        with self.conn:
+            # Read and write in one transaction so no other process commits in between
+            self.conn.execute("BEGIN IMMEDIATE")
+            for uid, profile, _, base in rows:
+                current = self.read_users(self.conn, [uid]).get(uid)
+                merged = None if profile is None else merge_records(base, profile, current or {})
+                # Shared strikes are written transactionally by SharedState.update_strikes
+                self._write_user(uid, merged, None, with_strikes=False)
+                # Our own rows are skipped by sync(); if the merge kept another process's
+                # values, tag it so this process reads the merged row back too
+                self.conn.execute(
+                    "INSERT INTO changes (kind, key, origin, ts) VALUES ('user', ?, ?, ?)",
+                    (uid, PROCESS_TOKEN if merged == profile else "merge", time.time())
+                )
+
+    def committed(self, rows):
+        """After a successful write, on the loop: what we wrote is the new base."""
+        for uid, profile, _, base in rows:
+            # Unless sync() already replaced the base with a newer read
+            if self.synced.get(uid) is base:
+                self.remember(uid, profile)
+
+    def remember(self, uid: str, profile: Optional[dict]):
+        if not self.shared:
+            return
+        if profile is None:
+            self.synced.pop(uid, None)
+        else:
+            self.synced[uid] = profile
 
+    def _write_user(self, uid: str, profile: Optional[dict], strike: Optional[dict], with_strikes: bool = True):
+        if profile is None:
+            self.conn.execute("DELETE FROM profiles WHERE user_id = ?", (uid,))
+            self.conn.execute("DELETE FROM ranks WHERE user_id = ?", (uid,))
+        else:
+            extra = {k: v for k, v in profile.items() if k not in self.PROFILE_KEYS}
+            self.conn.execute(
+                "INSERT INTO profiles (user_id, display_name, extra) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET display_name = excluded.display_name, extra = excluded.extra",
+                (uid, profile.get("display_name"), json.dumps(extra) if extra else None)
+            )
+            if "rank" in profile:
+                self.conn.execute(
+                    "INSERT INTO ranks (user_id, rank, tier) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET rank = excluded.rank, tier = excluded.tier",
+                    (uid, profile["rank"], profile.get("tier") or "n/a")
+                )
+            else:
+                self.conn.execute("DELETE FROM ranks WHERE user_id = ?", (uid,))
 
-intents = discord.Intents.all()
-bot = commands.Bot(command_prefix="!", intents=intents)
+        if with_strikes:
+            self.write_strike(self.conn, uid, strike)
 
+    @staticmethod
+    def write_strike(conn: sqlite3.Connection, uid: str, strike: Optional[dict]):
+        if strike is None:
+            conn.execute("DELETE FROM strikes WHERE user_id = ?", (uid,))
+            return
+        expires = strike.get("expires")
+        conn.execute(
+            "INSERT INTO strikes (user_id, host, grief, expires, guild_id) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET host = excluded.host, grief = excluded.grief, "
+            "expires = excluded.expires, guild_id = excluded.guild_id",
+            (uid, strike.get("host", 0), strike.get("grief", 0),
+             json.dumps(expires) if expires else None, strike.get("guild_id"))
+        )
+
+    def close(self):
+        self.conn.close()
+
+
+def migrate_json_to_sqlite(json_path: str, backend: SQLiteBackend) -> int:
+    """One-shot import of user_data_prl.json into the SQLite tables.
+
+    Runs once per database (recorded in the ``meta`` table); returns the number
+    of users imported.
+    """
+    done = backend.conn.execute("SELECT value FROM meta WHERE key = 'migrated_from_json'").fetchone()
+    if done or not os.path.exists(json_path):
+        return 0
+    data = JsonBackend(json_path).load()
+    strikes = data.get("strikes", {})
+    users = (set(data) - {"strikes"}) | set(strikes)
+    with backend.conn:
+        for uid in users:
+            backend._write_user(uid, data.get(uid), strikes.get(uid))
+        backend.conn.execute(
+            # OR IGNORE: shard processes starting together may both run the import
+            "INSERT OR IGNORE INTO meta (key, value) VALUES ('migrated_from_json', ?)",
+            (datetime.datetime.now().isoformat(),)
+        )
+    print(f"Migrated {len(users)} users from {json_path} to SQLite.")
+    return len(users)
+
+
+class UserDataStore:
+    """Write-behind persistence for ``user_data``.
+
+    Handlers mutate ``store.data`` in place and call ``mark_dirty(user_id)``.
+    Every write requested inside the debounce window is merged into one flush,
+    which is handed to the backend on a dedicated writer thread (atomic file
+    swap for JSON, one transaction of row upserts for SQLite).
+    """
+
+    def __init__(self, backend, debounce: float = SAVE_DEBOUNCE_SECONDS):
+        self.backend = backend
+        self.debounce = debounce
+        self.data = backend.load()
+        self._dirty: set[str] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        # A single worker keeps writes ordered and never overlaps two renames
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prl-writer")
+        self.stats = {
+            "writes_requested": 0,
+            "writes_merged": 0,
+            "flushes": 0,
+            "flush_errors": 0,
+            "last_flush_ms": 0.0,
+        }
+
+    def is_dirty(self, key: str) -> bool:
+        return str(key) in self._dirty
+
+    def mark_dirty(self, key: str):
+        """Record that ``key`` changed and schedule a debounced flush."""
+        self.stats["writes_requested"] += 1
+        self._dirty.add(str(key))
+        if self._flush_task and not self._flush_task.done():
+            self.stats["writes_merged"] += 1
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # No loop yet; the next flush/close picks it up
+        self._flush_task = loop.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.debounce)
+        # Let writes that arrive while we're flushing schedule the next round
+        self._flush_task = None
+        await self.flush()
+
+    def submit(self, fn, *args):
+        """Run ``fn`` on the writer thread, ordered after every queued flush."""
+        return asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def flush(self) -> bool:
+        if not self._dirty:
+            return True
+        dirty, self._dirty = self._dirty, set()
+        with span("persist.prepare", users=len(dirty)):
+            payload = self.backend.prepare(self.data, dirty)
+        started = time.perf_counter()
+        try:
+            with span("persist.write"):
+                await self.submit(self.backend.write, payload)
+        except Exception as e:
+            print(f"[Error saving user data] {e}")
+            self.stats["flush_errors"] += 1
+            self._dirty |= dirty
+            return False
+        self.backend.committed(payload)
+        elapsed = time.perf_counter() - started
+        self.stats["flushes"] += 1
+        self.stats["last_flush_ms"] = elapsed * 1000
+        metrics.flush_seconds.observe(elapsed)
+        return True
+
+    async def close(self):
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        self._flush_task = None
+        await self.flush()
+        self._executor.shutdown(wait=True)
+        self.backend.close()
+
+
+def make_storage_backend():
+    if STORAGE_BACKEND == "sqlite" or SHARED_STATE:
+        return SQLiteBackend(SQLITE_FILE, json_path=USER_DATA_FILE, shared=SHARED_STATE)
+    return JsonBackend(USER_DATA_FILE)
+
+
+user_store = UserDataStore(make_storage_backend())
+user_data = user_store.data
+
+
+# ——— Rank journal ———
+RANK_JOURNAL_FILE = process_file("rank_journal.jsonl")
+RANK_HISTORY_FILE = process_file("rank_history.jsonl")
+JOURNAL_COMPACT_INTERVAL = 300  # seconds between background compactions
+JOURNAL_COMPACT_RECORDS = 500   # compact early once this many records pile up
+
+
+class StoreJournal:
+    """Append-only JSONL log of changes layered over the user_data snapshot.
+
+    A change is one appended line instead of a snapshot rewrite. On startup
+    the journal is replayed over the snapshot; compaction folds it into a new
+    snapshot and moves the folded records to the history file. Subclasses
+    say how a record changes user_data and which users it touches.
+
+    Records carry a sequence number, and applying one stamps it on each
+    touched profile (``journal_seq``). Replay skips users whose saved
+    profile already includes the record, so a crash between a flush and
+    the truncate that follows it can't apply a record twice.
+    """
+
+    name = "journal"
+
+    def __init__(self, store: UserDataStore, path: str, history_path: str):
+        self.store = store
+        self.path = path
+        self.history_path = history_path
+        # Per file, so shard processes with their own journals keep separate counters
+        self.seq_key = os.path.basename(path)
+        self._seq = 0
+        self._pending = 0  # records in the journal file (written or queued)
+        self._touched: set[str] = set()
+        self._compacting = False
+
+    @staticmethod
+    def _apply(data: dict, record: dict, users: list[str]):
+        raise NotImplementedError
+
+    @staticmethod
+    def _users(record: dict) -> tuple:
+        raise NotImplementedError
+
+    def _folded(self, user_id: str) -> int:
+        profile = self.store.data.get(user_id)
+        return profile.get("journal_seq", {}).get(self.seq_key, 0) if profile else 0
+
+    def _apply_record(self, record: dict):
+        """Apply to the users whose profile hasn't seen ``record`` yet and stamp them."""
+        seq = record.get("seq")  # None on lines written before sequence numbers
+        users = [u for u in self._users(record) if seq is None or seq > self._folded(u)]
+        self._apply(self.store.data, record, users)
+        if seq is not None:
+            for user_id in users:
+                self.store.data.setdefault(user_id, {}).setdefault("journal_seq", {})[self.seq_key] = seq
+        self._touched.update(users)
+
+    def replay(self) -> int:
+        # Continue numbering above anything already folded, even if the file is empty
+        self._seq = max((
+            profile.get("journal_seq", {}).get(self.seq_key, 0)
+            for key, profile in self.store.data.items() if key != "strikes"
+        ), default=0)
+        for line in read_journal_lines(self.path):
+            # Every line counts toward _pending: _truncate() drops lines by position
+            self._pending += 1
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # mangled by an older version; skip rather than fail startup
+            self._apply_record(record)
+            self._seq = max(self._seq, record.get("seq", 0))
+        return self._pending
+
+    def _append(self, record: dict):
+        self._seq += 1
+        record["seq"] = self._seq
+        self._apply_record(record)
+        self._pending += 1
+        with span(f"{self.name}.append"):
+            future = self.store.submit(self._write_line, json.dumps(record) + "\n")
+        future.add_done_callback(self._report_error)
+        if self._pending >= JOURNAL_COMPACT_RECORDS and not self._compacting:
+            asyncio.create_task(self.compact())
+
+    def _report_error(self, future):
+        if not future.cancelled() and future.exception():
+            print(f"[Error appending {self.name}] {future.exception()}")
+
+    def pending_for(self, user_id: str) -> bool:
+        """True while a record for ``user_id`` hasn't been folded into the snapshot."""
+        return user_id in self._touched
+
+    def _write_line(self, line: str):
+        with open(self.path, "a") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _truncate(self, upto: int):
+        """Drop the first ``upto`` records (now in the snapshot) into the history file."""
+        try:
+            with open(self.path, "r") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        with open(self.history_path, "a") as f:
+            f.writelines(lines[:upto])
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.writelines(lines[upto:])
+        os.replace(tmp_path, self.path)
+
+    async def compact(self):
+        if not self._pending or self._compacting:
+            return
+        self._compacting = True
+        try:
+            # Capture and flush without yielding in between: every record counted
+            # in ``upto`` is already in the snapshot the flush below prepares.
+            upto, touched = self._pending, self._touched
+            self._touched = set()
+            for uid in touched:
+                self.store.mark_dirty(uid)
+            if not await self.store.flush():
+                self._touched |= touched
+                return
+            await self.store.submit(self._truncate, upto)
+            self._pending -= upto
+        except Exception as e:
+            print(f"[Error compacting {self.name}] {e}")
+        finally:
+            self._compacting = False
+
+    async def run_compactor(self):
+        while True:
+            await asyncio.sleep(JOURNAL_COMPACT_INTERVAL)
+            await self.compact()
+
+
+class RankJournal(StoreJournal):
+    """Rank/tier changes from #rank-logs; folded records land in ``RANK_HISTORY_FILE``."""
+
+    name = "rank_journal"
+
+    @staticmethod
+    def _apply(data: dict, record: dict, users: list[str]):
+        for user_id in users:
+            profile = data.setdefault(user_id, {})
+            profile["rank"] = record["rank"]
+            profile["tier"] = record["tier"]
+
+    @staticmethod
+    def _users(record: dict) -> tuple:
+        return (record["user_id"],)
+
+    def append(self, user_id, rank: str, tier: str, from_rank: str, from_tier: str, by=None):
+        self._append({
+            "ts": datetime.datetime.now().isoformat(timespec="seconds"),
+            "user_id": str(user_id),
+            "rank": rank,
+            "tier": tier,
+            "from_rank": from_rank,
+            "from_tier": from_tier,
+            "by": str(by) if by else None,
+        })
+
+
+rank_journal = RankJournal(user_store, RANK_JOURNAL_FILE, RANK_HISTORY_FILE)
+rank_journal.replay()
+
+
+# ——— Match history ———
+MATCH_JOURNAL_FILE = process_file("match_journal.jsonl")
+MATCH_HISTORY_FILE = process_file("match_history.jsonl")
+
+
+class MatchJournal(StoreJournal):
+    """Finished matches, one compact line each, plus per-player counters.
+
+    Every match bumps the ``stats`` counters on each player's profile as it
+    is recorded, so /stats reads a handful of numbers and never the history.
+    Records folded into the snapshot move to ``MATCH_HISTORY_FILE``, which
+    is the permanent match history.
+    """
+
+    name = "match_journal"
+
+    @staticmethod
+    def _apply(data: dict, record: dict, users: list[str]):
+        for user_id in users:
+            stats = data.setdefault(user_id, {}).setdefault("stats", {})
+            stats["played"] = stats.get("played", 0) + 1
+            stats["seconds"] = stats.get("seconds", 0) + record["seconds"]
+            regions = stats.setdefault("regions", {})
+            regions[record["region"]] = regions.get(record["region"], 0) + 1
+            formats = stats.setdefault("formats", {})
+            formats[record["matchtype"]] = formats.get(record["matchtype"], 0) + 1
+            if user_id == record["host"]:
+                stats["hosted"] = stats.get("hosted", 0) + 1
+
+    @staticmethod
+    def _users(record: dict) -> tuple:
+        return tuple(record["players"])
+
+    def record(self, host_id: int, game: dict):
+        ended = datetime.datetime.now()
+        self._append({
+            "ts": ended.isoformat(timespec="seconds"),
+            "start": game["start_time"].isoformat(timespec="seconds"),
+            "seconds": max(0, int((ended - game["start_time"]).total_seconds())),
+            "host": str(host_id),
+            "players": [str(p["id"]) for p in game["players"]],
+            "region": game["region"],
+            "gametype": game["gametype"],
+            "matchtype": game["matchtype"],
+        })
+
+
+match_journal = MatchJournal(user_store, MATCH_JOURNAL_FILE, MATCH_HISTORY_FILE)
+match_journal.replay()
+
+
+# ——— Audit log dispatcher ———
+LOG_FLUSH_INTERVAL = 2.0     # seconds between batch flushes
+LOG_BATCH_EMBEDS = 10        # Discord allows 10 embeds per message...
+LOG_BATCH_CHARS = 6000       # ...and 6000 characters across them
+LOG_QUEUE_LIMIT = 500        # past this many queued embeds, new ones spill to disk
+LOG_MAX_RETRIES = 5
+LOG_SPILL_FILE = process_file("log_spill.jsonl")
+
+
+class LogDispatcher:
+    """Queues log embeds and posts them in packed batches off the hot path.
+
+    Handlers call ``post()`` and move on. A background task flushes every
+    ``LOG_FLUSH_INTERVAL`` (or as soon as a full batch is ready), retries with
+    exponential backoff, and under sustained backpressure spills embeds to
+    ``LOG_SPILL_FILE`` to be replayed once the queues drain.
+    """
+
+    def __init__(self, store: UserDataStore, spill_path: str = LOG_SPILL_FILE):
+        self.store = store
+        self.spill_path = spill_path
+        self._queues: dict[int, deque] = {}
+        self._channels: dict[int, discord.abc.Messageable] = {}
+        self._queued = 0
+        # Non-zero means there may be spilled embeds (possibly from the last run) to replay
+        self._spilled = 1 if os.path.exists(spill_path) else 0
+        self._wakeup = asyncio.Event()
+        self.stats = {"queued": 0, "sent_messages": 0, "sent_embeds": 0, "retries": 0, "dropped": 0, "spilled": 0}
+
+    def post(self, channel: discord.abc.Messageable, embed: discord.Embed):
+        self.stats["queued"] += 1
+        self._channels[channel.id] = channel
+        if self._queued >= LOG_QUEUE_LIMIT:
+            self._spill([(channel.id, embed)])
+            return
+        self._queues.setdefault(channel.id, deque()).append(embed)
+        self._queued += 1
+        if len(self._queues[channel.id]) >= LOG_BATCH_EMBEDS:
+            self._wakeup.set()
+
+    def depth(self) -> int:
+        return self._queued
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), LOG_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"[Error flushing log queue] {e}")
+
+    @staticmethod
+    def _take_batch(queue: deque) -> list[discord.Embed]:
+        batch, chars = [], 0
+        while queue and len(batch) < LOG_BATCH_EMBEDS:
+            size = len(queue[0])
+            if batch and chars + size > LOG_BATCH_CHARS:
+                break
+            batch.append(queue.popleft())
+            chars += size
+        return batch
+
+    async def flush(self, retries: int = LOG_MAX_RETRIES):
+        for channel_id, queue in list(self._queues.items()):
+            while queue:
+                batch = self._take_batch(queue)
+                self._queued -= len(batch)
+                if not await self._send(channel_id, batch, retries):
+                    # Channel is struggling: put the batch back and try again next flush
+                    queue.extendleft(reversed(batch))
+                    self._queued += len(batch)
+                    break
+        if not self._queued and self._spilled:
+            await self._replay_spill()
+
+    async def _send(self, channel_id: int, batch: list[discord.Embed], retries: int) -> bool:
+        channel = self._channels.get(channel_id) or bot.get_channel(channel_id)
+        if not channel:
+            self.stats["dropped"] += len(batch)
+            return True
+        delay = 1.0
+        for attempt in range(retries):
+            try:
+                await rest.call(PRIORITY_LOG, f"channel.send:{channel_id}", channel.send, embeds=batch)
+                self.stats["sent_messages"] += 1
+                self.stats["sent_embeds"] += len(batch)
+                return True
+            except discord.HTTPException as e:
+                if e.status != 429 and e.status < 500:
+                    print(f"[Error sending log batch] {e}")
+                    self.stats["dropped"] += len(batch)
+                    return True
+                self.stats["retries"] += 1
+                await asyncio.sleep(delay)
+                delay *= 2
+        return False
+
+    def _spill(self, items: list[tuple[int, discord.Embed]]):
+        lines = "".join(
+            json.dumps({"channel_id": channel_id, "embed": embed.to_dict()}) + "\n"
+            for channel_id, embed in items
+        )
+        self._spilled += len(items)
+        self.stats["spilled"] += len(items)
+        try:
+            self.store.submit(self._append_spill, lines)
+        except RuntimeError:
+            self._append_spill(lines)
+
+    def _append_spill(self, lines: str):
+        with open(self.spill_path, "a") as f:
+            f.write(lines)
+
+    def _drain_spill(self) -> list[str]:
+        try:
+            with open(self.spill_path, "r") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return []
+        os.remove(self.spill_path)
+        return lines
+
+    async def _replay_spill(self):
+        lines = await self.store.submit(self._drain_spill)
+        self._spilled = 0
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            channel_id = record["channel_id"]
+            self._queues.setdefault(channel_id, deque()).append(discord.Embed.from_dict(record["embed"]))
+            self._queued += 1
+
+    async def close(self):
+        """Last flush on shutdown; anything that still can't be sent is spilled."""
+        await self.flush(retries=1)
+        leftovers = [(cid, e) for cid, q in self._queues.items() for e in q]
+        if leftovers:
+            self._spill(leftovers)
+        self._queues.clear()
+        self._queued = 0
+
+
+audit_log = LogDispatcher(user_store)
+
+
+# ——— Roles ———
+# Every role the bot looks up by name is configured here
+RANK_NAMES = {
+    "r1": "R1 - Drone",
+    "r2": "R2 - Bot",
+    "r3": "R3 - Noob",
+    "r4": "R4 - Semi-Pro",
+    "r5": "R5 - Pro",
+    "r6": "R6 - Ancient",
+    "r7": "R7 - Mythical",
+    "r8": "R8 - Master",
+    "r9": "R9 - Supreme",
+    "r10": "R10 - Overlord",
+    "r11": "R11 - Celestial"
+}
+# Hierarchy from highest (r11) to lowest (r1)
+RANK_ORDER = list(RANK_NAMES.keys())[::-1]
+TIER_NAMES = ["low", "mid", "high"]
+# Tier ordering for tiebreaks: higher tier first
+TIER_ORDER = {"high": 2, "mid": 1, "low": 0, "unranked": -1}
+RANK_POSITION = {code: i for i, code in enumerate(RANK_ORDER)}
+RANK_CODES = {name: code for code, name in RANK_NAMES.items()}
+# Region roles members pick; the first one a member holds is their region
+REGION_ROLES = ["NA", "EU", "SA", "ASIA", "OCE", "AF"]
+# Strike type -> role handed out at 3 strikes of that type
+STRIKE_ROLES = {"host": "Host Back Ban", "grief": "Griefing Bail"}
+
+
+def tier_role_name(tier: Optional[str]) -> Optional[str]:
+    return tier.capitalize() if tier else None
+
+
+class RoleIndex:
+    """Name -> role and id -> role for one guild.
+
+    ``discord.utils.get(guild.roles, name=...)`` walks every role on each
+    call; this is built once per guild and thrown away on any role event, so
+    lookups are dict hits. Like ``utils.get``, the lowest role wins when two
+    share a name.
+    """
+
+    def __init__(self, roles):
+        self.by_id: dict[int, discord.Role] = {}
+        self.by_name: dict[str, discord.Role] = {}
+        self.rank_codes: dict[int, str] = {}   # role id -> "r1".."r11"
+        self.tier_codes: dict[int, str] = {}   # role id -> "low"/"mid"/"high"
+        self.regions: dict[int, str] = {}      # role id -> region name
+        for role in roles:
+            self.by_id[role.id] = role
+            self.by_name.setdefault(role.name, role)
+            if role.name in RANK_CODES:
+                self.rank_codes[role.id] = RANK_CODES[role.name]
+            if role.name.lower() in TIER_NAMES:
+                self.tier_codes[role.id] = role.name.lower()
+            if role.name.upper() in REGION_ROLES:
+                self.regions[role.id] = role.name.upper()
+
+    def named(self, name: Optional[str]) -> Optional[discord.Role]:
+        return self.by_name.get(name) if name else None
+
+
+role_indexes: dict[int, RoleIndex] = {}
+
+
+def guild_roles(guild: discord.Guild) -> RoleIndex:
+    index = role_indexes.get(guild.id)
+    if index is None:
+        index = role_indexes[guild.id] = RoleIndex(guild.roles)
+    return index
+
+
+def get_role(guild: discord.Guild, name: Optional[str]) -> Optional[discord.Role]:
+    return guild_roles(guild).named(name)
+
+
+def has_role(member: discord.Member, role: Optional[discord.Role]) -> bool:
+    # Member.get_role checks the member's role ids without building Member.roles
+    return role is not None and member.get_role(role.id) is not None
+
+
+def roles_changed(guild_id: int):
+    role_indexes.pop(guild_id, None)
+    invalidate_guild_profiles(guild_id)  # a renamed role can change anyone's region/rank
+
+
+@bot.event
+async def on_guild_role_create(role: discord.Role):
+    roles_changed(role.guild.id)
+
+
+@bot.event
+async def on_guild_role_update(before: discord.Role, after: discord.Role):
+    roles_changed(after.guild.id)
+
+
+@bot.event
+async def on_guild_role_delete(role: discord.Role):
+    roles_changed(role.guild.id)
+
+
+@bot.event
+async def on_guild_remove(guild: discord.Guild):
+    roles_changed(guild.id)
+
+
+# ——— Player profiles ———
+class PlayerProfile:
+    """What the lobby embeds and logs show about a member, resolved once.
+
+    Region comes from the member's region role. Rank and tier come from the
+    stored profile the rank logs maintain, falling back to rank/tier roles
+    for members who never went through a rank log.
+    """
+
+    __slots__ = ("user_id", "region", "rank", "tier", "ign")
+
+    def __init__(self, user_id: int, region: Optional[str], rank: Optional[str], tier: Optional[str], ign: Optional[str]):
+        self.user_id = user_id
+        self.region = region
+        self.rank = rank
+        self.tier = tier
+        self.ign = ign
+
+    @property
+    def rank_display(self) -> str:
+        rank = RANK_NAMES.get(self.rank, "Unranked")
+        return f"{rank} {self.tier.capitalize()}" if self.tier else rank
+
+    @classmethod
+    def resolve(cls, member: discord.Member) -> "PlayerProfile":
+        roles = guild_roles(member.guild)
+        region = role_rank = role_tier = None
+        for r in member.roles:
+            region = region or roles.regions.get(r.id)
+            rank = roles.rank_codes.get(r.id)
+            if rank and (role_rank is None or RANK_POSITION[rank] < RANK_POSITION[role_rank]):
+                role_rank = rank
+            role_tier = role_tier or roles.tier_codes.get(r.id)
+
+        profile = cls.stored(member.id)
+        profile.region = region
+        if profile.rank is None:
+            profile.rank, profile.tier = role_rank, role_tier if role_rank else None
+        return profile
+
+    @classmethod
+    def stored(cls, user_id: int) -> "PlayerProfile":
+        """Profile from saved data alone, for players who can't be resolved to a member."""
+        stored = user_data.get(str(user_id), {})
+        rank = stored.get("rank")
+        tier = stored.get("tier")
+        if rank not in RANK_NAMES:
+            rank = tier = None
+        elif tier not in TIER_NAMES:
+            tier = None
+        ign = (stored.get("display_name") or "").strip() or None
+        return cls(user_id, None, rank, tier, ign)
+
+
+# user id -> {guild id: (role ids, profile)}, least recently used first; dropped
+# on rank and IGN changes. Keyed by user so dropping everything for a user is O(1).
+# member_update never fires for members outside the member cache, so the role ids
+# the profile was resolved from are kept with it and compared on every lookup —
+# interaction payloads always carry the member's current roles.
+PROFILE_CACHE_SIZE = int(os.getenv("PRL_PROFILE_CACHE_SIZE", "5000"))
+player_profiles: "OrderedDict[int, dict[int, tuple[tuple[int, ...], PlayerProfile]]]" = OrderedDict()
+
+
+def player_profile(member: discord.Member) -> PlayerProfile:
+    by_guild = player_profiles.get(member.id)
+    if by_guild is None:
+        by_guild = player_profiles[member.id] = {}
+        while len(player_profiles) > PROFILE_CACHE_SIZE:
+            player_profiles.popitem(last=False)
+    else:
+        player_profiles.move_to_end(member.id)
+    role_ids = tuple(member._roles)
+    cached = by_guild.get(member.guild.id)
+    if cached is None or cached[0] != role_ids:
+        cached = by_guild[member.guild.id] = (role_ids, PlayerProfile.resolve(member))
+    return cached[1]
+
+
+def invalidate_profile(user_id: int, guild_id: Optional[int] = None):
+    if guild_id is None:
+        player_profiles.pop(user_id, None)  # IGN and stored rank aren't per guild
+        return
+    by_guild = player_profiles.get(user_id)
+    if by_guild:
+        by_guild.pop(guild_id, None)
+
+
+def invalidate_guild_profiles(guild_id: int):
+    # Only on role create/rename/delete, so a full pass is fine here
+    for by_guild in player_profiles.values():
+        by_guild.pop(guild_id, None)
 
-# Load persistent user data from JSON
-user_data_file = "user_data_prl.json"
-try:
-    with open(user_data_file, "r") as f:
-        user_data = json.load(f)
-except (FileNotFoundError, json.JSONDecodeError):
-    user_data = {}
 
 # Global store for active games
 active_games: dict[int, dict] = {}
+# Reverse index: player id -> host id of the one game that player is in
+player_games: dict[int, int] = {}
 
-class LeagueView(View):
-    def __init__(
-        self,
-        host_id: int,
-        thread_id: int,
-        hosting_msg_id: int,
-        thread_msg_id: int,
-        gametype: str,
-        matchtype: str,
-        region: str,
-        player_cap: int
-    ):
-        super().__init__(timeout=None)
-        self.host_id = host_id
-        self.thread_id = thread_id
-        self.hosting_msg_id = hosting_msg_id
-        self.thread_msg_id = thread_msg_id
-        self.gametype = gametype
-        self.matchtype = matchtype
-        self.region = region
-        self.player_cap = player_cap
-
-    async def add_player(
-        self,
-        interaction: discord.Interaction,
-        user: discord.Member,
-        display_name: str
-    ):
-        game = active_games.get(self.host_id)
+
+# Every helper below records first: with shared state the database decides,
+# and local dicts only change once the write went through.
+def register_game(host_id: int, game: dict, record: bool = True) -> bool:
+    """False if another shard process seated the host or a player first."""
+    if record and not game_log.record("host", host_id, game=serialize_game(game)):
+        return False
+    game["player_ids"] = {p["id"] for p in game["players"]}
+    active_games[host_id] = game
+    for player_id in game["player_ids"]:
+        player_games[player_id] = host_id
+    return True
+
+
+def update_game(host_id: int, **fields):
+    """Set extra fields on a game (message ids etc.) and journal them."""
+    game = active_games.get(host_id)
+    if game and game_log.record("update", host_id, fields=fields):
+        game.update(fields)
+
+
+def add_game_player(host_id: int, user_id: int, display_name: str) -> bool:
+    """Add a player to a game; False if they're already in this or another game,
+    or (shared state) the lobby filled up on another process."""
+    game = active_games.get(host_id)
+    if not game or user_id in player_games:
+        return False
+    player = {"id": user_id, "display_name": display_name}
+    if not game_log.record("join", host_id, player=player):
+        return False
+    game["players"].append(player)
+    game["player_ids"].add(user_id)
+    player_games[user_id] = host_id
+    matchmaker.remove(user_id)  # a seat in a lobby ends any queue wait
+    return True
+
+
+def remove_game_player(host_id: int, user_id: int) -> bool:
+    game = active_games.get(host_id)
+    if not game or user_id not in game["player_ids"] or not game_log.record("leave", host_id, user_id=user_id):
+        return False
+    game["player_ids"].discard(user_id)
+    game["players"] = [p for p in game["players"] if p["id"] != user_id]
+    if player_games.get(user_id) == host_id:
+        del player_games[user_id]
+    return True
+
+
+def drop_game(host_id: int) -> Optional[dict]:
+    """Forget a game locally without recording anything."""
+    game = active_games.pop(host_id, None)
+    if game:
+        for player_id in game["player_ids"]:
+            if player_games.get(player_id) == host_id:
+                del player_games[player_id]
+    return game
+
+
+def end_game(host_id: int) -> Optional[dict]:
+    if host_id not in active_games or not game_log.record("end", host_id):
+        return None
+    game = drop_game(host_id)
+    match_journal.record(host_id, game)
+    return game
+
+
+def serialize_game(game: dict) -> dict:
+    data = {k: v for k, v in game.items() if k != "player_ids"}
+    data["players"] = [dict(p) for p in game["players"]]
+    data["start_time"] = game["start_time"].isoformat()
+    return data
+
+
+def deserialize_game(data: dict) -> dict:
+    game = dict(data)
+    game["start_time"] = datetime.datetime.fromisoformat(data["start_time"])
+    return game
+
+
+# ——— Game state persistence ———
+GAMES_JOURNAL_FILE = process_file("games_journal.jsonl")
+GAMES_SNAPSHOT_FILE = process_file("games_snapshot.json")
+GAMES_SNAPSHOT_INTERVAL = 60  # seconds between snapshots while games change
+
+
+class GameStateLog:
+    """Crash-safe persistence for ``active_games``.
+
+    Every host/join/leave/end is appended to a small event journal on the
+    writer thread. A periodic snapshot folds the journal into one file. On
+    startup the snapshot plus journal rebuild ``active_games`` from disk
+    alone, so no threads have to be fetched from the API.
+    """
+
+    def __init__(self, store: UserDataStore, journal_path: str, snapshot_path: str):
+        self.store = store
+        self.journal_path = journal_path
+        self.snapshot_path = snapshot_path
+        self._pending = 0
+        self._snapshotting = False
+
+    def record(self, op: str, host_id: int, **fields) -> bool:
+        self._pending += 1
+        with span(f"games_journal.{op}"):
+            line = json.dumps({"op": op, "host_id": host_id, **fields}) + "\n"
+            future = self.store.submit(self._append, line)
+        future.add_done_callback(self._report_error)
+        return True  # this process is the only writer, so nothing can conflict
+
+    @staticmethod
+    def _report_error(future):
+        if not future.cancelled() and future.exception():
+            print(f"[Error journaling game state] {future.exception()}")
+
+    def _append(self, line: str):
+        with open(self.journal_path, "a") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def _apply(games: dict, event: dict):
+        host_id = str(event["host_id"])
+        op = event["op"]
+        if op == "host":
+            games[host_id] = event["game"]
+            return
+        game = games.get(host_id)
         if not game:
-            return await interaction.response.send_message(
-                "This game is no longer active.", ephemeral=True
-            )
+            return
+        if op == "join":
+            # A crash between writing the snapshot and cutting the journal replays
+            # joins the snapshot already has
+            if all(p["id"] != event["player"]["id"] for p in game["players"]):
+                game["players"].append(event["player"])
+        elif op == "leave":
+            game["players"] = [p for p in game["players"] if p["id"] != event["user_id"]]
+        elif op == "update":
+            game.update(event["fields"])
+        elif op == "end":
+            del games[host_id]
+
+    def restore(self) -> int:
+        try:
+            with open(self.snapshot_path, "r") as f:
+                games = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            games = {}
+        for line in read_journal_lines(self.journal_path):
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError:
+                event = None  # mangled by an older version; still a line for the snapshot count
+            if event:
+                self._apply(games, event)
+            self._pending += 1
+        for host_id, data in games.items():
+            register_game(int(host_id), deserialize_game(data), record=False)
+        return len(games)
+
+    def _write_snapshot(self, games: dict, upto: int):
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(games, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        # Keep only the events queued after this snapshot was taken
+        try:
+            with open(self.journal_path, "r") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        tmp_path = f"{self.journal_path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.writelines(lines[upto:])
+        os.replace(tmp_path, self.journal_path)
 
-        # Enforce capacity from in-memory game state
-        if len(game['players']) >= self.player_cap:
-            return await interaction.response.send_message(
-                f"Sorry, this match is full ({len(game['players'])}/{self.player_cap}).",
-                ephemeral=True
-            )
+    async def snapshot(self):
+        if not self._pending or self._snapshotting:
+            return
+        self._snapshotting = True
+        try:
+            upto = self._pending
+            games = {str(h): serialize_game(g) for h, g in active_games.items()}
+            await self.store.submit(self._write_snapshot, games, upto)
+            self._pending -= upto
+        except Exception as e:
+            print(f"[Error snapshotting games] {e}")
+        finally:
+            self._snapshotting = False
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(GAMES_SNAPSHOT_INTERVAL)
+            await self.snapshot()
+
+
+# ——— Shared state (sharded mode) ———
+SHARED_SYNC_INTERVAL = 5         # seconds between background catch-ups
+SHARED_CHANGE_RETENTION = 600    # seconds change-feed rows are kept for slow readers
+
+
+class StateConflict(Exception):
+    """A shared write lost to another process (lobby full, seat or host taken)."""
+
+
+class SharedState:
+    """Games, seats and strikes in SQLITE_FILE, shared by every shard process.
+
+    Stands in for ``GameStateLog`` when PRL_SHARED_STATE=1. Each write is one
+    ``BEGIN IMMEDIATE`` transaction that checks the database rather than this
+    process's dicts: ``game_players`` has one row per seated player, so two
+    processes can't seat someone twice or overfill a lobby. The loser gets
+    False and resyncs. Writes also append to ``changes``, which ``sync()``
+    reads to pull other processes' games and user rows into local state.
+    """
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # No fsync per commit in WAL mode (only at checkpoints), so a seat costs no disk wait
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(f"PRAGMA busy_timeout={SHARED_LOOP_BUSY_TIMEOUT_MS}")
+        self.conn.executescript(SQLiteBackend.SCHEMA + SQLiteBackend.SHARED_SCHEMA)
+        SQLiteBackend.upgrade_schema(self.conn)
+        self.last_seq = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+        self._data_version = None
+
+    @contextlib.contextmanager
+    def _transaction(self, mode: str = "IMMEDIATE"):
+        self.conn.execute(f"BEGIN {mode}")
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def _changed(self, kind: str, key):
+        self.conn.execute(
+            "INSERT INTO changes (kind, key, origin, ts) VALUES (?, ?, ?, ?)",
+            (kind, str(key), PROCESS_TOKEN, time.time())
+        )
 
-        # Additional race-check using thread member count
-        thread = interaction.guild.get_thread(self.thread_id)
-        if thread and thread.member_count >= self.player_cap:
-            return await interaction.response.send_message(
-                f"Sorry, this match is already at capacity ({thread.member_count}/{self.player_cap}).",
-                ephemeral=True
-            )
+    def _game(self, host_id: int) -> Optional[dict]:
+        row = self.conn.execute("SELECT data FROM games WHERE host_id = ?", (host_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _store(self, host_id: int, game: dict):
+        self.conn.execute("UPDATE games SET data = ? WHERE host_id = ?", (json.dumps(game), host_id))
+
+    # ——— GameStateLog interface ———
+    def record(self, op: str, host_id: int, **fields) -> bool:
+        with span(f"shared_state.{op}"):
+            try:
+                with self._transaction():
+                    getattr(self, f"_{op}")(host_id, **fields)
+                    self._changed("game", host_id)
+            except (StateConflict, sqlite3.IntegrityError):
+                metrics.shared_conflicts += 1
+                sync_shared_state()
+                return False
+            except sqlite3.Error as e:
+                print(f"[Error writing shared game state] {e}")
+                return False
+        return True
+
+    def _host(self, host_id: int, game: dict):
+        # Both inserts raise IntegrityError if the host or a player is already seated
+        self.conn.execute("INSERT INTO games (host_id, data) VALUES (?, ?)", (host_id, json.dumps(game)))
+        self.conn.executemany(
+            "INSERT INTO game_players (user_id, host_id) VALUES (?, ?)",
+            [(p["id"], host_id) for p in game["players"]]
+        )
 
-        # Prevent duplicates
-        if any(p['id'] == user.id for p in game['players']):
-            return await interaction.response.send_message(
-                "You're already in this match.", ephemeral=True
+    def _join(self, host_id: int, player: dict):
+        game = self._game(host_id)
+        if not game or len(game["players"]) >= game["player_cap"]:
+            raise StateConflict(host_id)
+        self.conn.execute("INSERT INTO game_players (user_id, host_id) VALUES (?, ?)", (player["id"], host_id))
+        game["players"].append(player)
+        self._store(host_id, game)
+
+    def _leave(self, host_id: int, user_id: int):
+        self.conn.execute("DELETE FROM game_players WHERE user_id = ? AND host_id = ?", (user_id, host_id))
+        game = self._game(host_id)
+        if game:
+            game["players"] = [p for p in game["players"] if p["id"] != user_id]
+            self._store(host_id, game)
+
+    def _update(self, host_id: int, fields: dict):
+        game = self._game(host_id)
+        if not game:
+            raise StateConflict(host_id)
+        game.update(fields)
+        self._store(host_id, game)
+
+    def _end(self, host_id: int):
+        self.conn.execute("DELETE FROM games WHERE host_id = ?", (host_id,))
+        self.conn.execute("DELETE FROM game_players WHERE host_id = ?", (host_id,))
+
+    def restore(self) -> int:
+        rows = self.conn.execute("SELECT host_id, data FROM games").fetchall()
+        for host_id, data in rows:
+            register_game(host_id, deserialize_game(json.loads(data)), record=False)
+        return len(rows)
+
+    async def snapshot(self):
+        pass  # every write is already committed
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(SHARED_SYNC_INTERVAL)
+            try:
+                self.sync()
+                self.prune()
+            except sqlite3.Error as e:
+                print(f"[Error syncing shared state] {e}")
+
+    # ——— Strikes ———
+    def update_strikes(self, user_id: str, change) -> tuple[dict, bool]:
+        """Read-modify-write one strike entry; ``change(entry)`` returns whether it applied."""
+        with self._transaction():
+            entry = strike_entry(SQLiteBackend.read_users(self.conn, [user_id])["strikes"].get(user_id))
+            if not change(entry):
+                return entry, False
+            SQLiteBackend.write_strike(self.conn, user_id, entry)
+            self._changed("user", user_id)
+        return entry, True
+
+    # ——— Catching up ———
+    def sync(self):
+        """Apply other processes' writes since the last call to the local dicts."""
+        # data_version only moves when another connection commits, so idle syncs are one pragma
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return
+        self._data_version = version
+        with self._transaction("DEFERRED"):
+            pruned = self.conn.execute("SELECT value FROM meta WHERE key = 'changes_pruned_upto'").fetchone()
+            if pruned and int(pruned[0]) > self.last_seq:
+                return self._reload()
+            games, users = set(), set()
+            for seq, kind, key, origin in self.conn.execute(
+                "SELECT seq, kind, key, origin FROM changes WHERE seq > ? ORDER BY seq", (self.last_seq,)
+            ).fetchall():
+                self.last_seq = seq
+                if origin != PROCESS_TOKEN:
+                    (games if kind == "game" else users).add(key)
+            for host_id in games:
+                self._refresh_game(int(host_id), self._game(int(host_id)))
+            if users:
+                self._refresh_users(users, SQLiteBackend.read_users(self.conn, list(users)))
+
+    def _reload(self):
+        """Fell behind the pruned change feed: compare everything."""
+        self.last_seq = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+        games = {h: json.loads(d) for h, d in self.conn.execute("SELECT host_id, data FROM games")}
+        for host_id in set(active_games) | set(games):
+            self._refresh_game(host_id, games.get(host_id))
+        fresh = SQLiteBackend.read_users(self.conn)
+        self._refresh_users((set(user_data) | set(fresh) | set(fresh["strikes"])) - {"strikes"}, fresh)
+
+    @staticmethod
+    def _refresh_game(host_id: int, data: Optional[dict]):
+        game = drop_game(host_id)
+        if data is None:
+            return
+        data = deserialize_game(data)
+        if game:
+            # Same dict object, so anything holding a reference sees the update
+            game.clear()
+            game.update(data)
+            data = game
+        register_game(host_id, data, record=False)
+
+    @staticmethod
+    def _refresh_users(user_ids, fresh: dict):
+        strikes = user_data.setdefault("strikes", {})
+        for uid in user_ids:
+            if uid in fresh["strikes"]:
+                strikes[uid] = fresh["strikes"][uid]
+                strike_timers.schedule(uid, strikes[uid])
+            else:
+                strikes.pop(uid, None)
+            # Unsaved local edits win; they reach the database on the next flush
+            if user_store.is_dirty(uid) or rank_journal.pending_for(uid) or match_journal.pending_for(uid):
+                continue
+            if uid in fresh:
+                user_data[uid] = fresh[uid]
+            else:
+                user_data.pop(uid, None)
+            user_store.backend.remember(uid, _copy_records(fresh.get(uid)))
+            invalidate_profile(int(uid))
+
+    def prune(self):
+        cutoff = time.time() - SHARED_CHANGE_RETENTION
+        with self._transaction():
+            upto = self.conn.execute("SELECT MAX(seq) FROM changes WHERE ts < ?", (cutoff,)).fetchone()[0]
+            if upto is None:
+                return
+            self.conn.execute("DELETE FROM changes WHERE seq <= ?", (upto,))
+            self.conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('changes_pruned_upto', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (str(upto),)
             )
 
-        # Add to state and thread
-        game['players'].append({"id": user.id, "display_name": display_name})
-        if thread:
-            await thread.add_user(user)
 
-        # Determine region role
-        region_role = next(
-            (r.name for r in user.roles if r.name in ["NA","EU","ASIA","OCE"]),
-            "Not specified"
+def sync_shared_state():
+    """Catch up on other shard processes before reading games or strikes."""
+    if not shared_state:
+        return
+    try:
+        shared_state.sync()
+    except sqlite3.Error as e:
+        print(f"[Error syncing shared state] {e}")
+
+
+shared_state = SharedState(SQLITE_FILE) if SHARED_STATE else None
+game_log = shared_state or GameStateLog(user_store, GAMES_JOURNAL_FILE, GAMES_SNAPSHOT_FILE)
+game_log.restore()
+
+
+# How long an idle per-game worker waits for more work before exiting
+GAME_ACTION_IDLE_SECONDS = 60
+
+
+class GameActionQueue:
+    """Runs each game's slow side effects (thread adds, embeds, logs) in order.
+
+    Admission decisions happen inline in the interaction; the follow-up API
+    calls are queued here so clickers get an immediate answer while one worker
+    per lobby works through the backlog in join order.
+    """
+
+    def __init__(self):
+        self._queues: dict[int, asyncio.Queue] = {}
+
+    def enqueue(self, host_id: int, fn, *args):
+        queue = self._queues.get(host_id)
+        if queue is None:
+            queue = self._queues[host_id] = asyncio.Queue()
+            asyncio.create_task(self._worker(host_id, queue))
+        queue.put_nowait((fn, args))
+
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self._queues.values())
+
+    async def _worker(self, host_id: int, queue: asyncio.Queue):
+        while True:
+            try:
+                fn, args = await asyncio.wait_for(queue.get(), GAME_ACTION_IDLE_SECONDS)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    self._queues.pop(host_id, None)
+                    return
+                continue
+            try:
+                await fn(*args)
+            except Exception as e:
+                print(f"[Error in game {host_id} side effect] {e}")
+
+
+game_actions = GameActionQueue()
+
+
+async def admit_player(
+    interaction: discord.Interaction,
+    host_id: int,
+    user: discord.Member,
+    display_name: str
+):
+    game = active_games.get(host_id)
+    if not game:
+        return await send_response(interaction,
+            "This game is no longer active.", ephemeral=True
+        )
+    player_cap = game['player_cap']
+
+    # Admission: capacity and duplicate checks plus the seat reservation run
+    # without an await in between, so a stampede of clicks can't overfill.
+    if len(game['players']) >= player_cap:
+        return await send_response(interaction,
+            f"Sorry, this match is full ({len(game['players'])}/{player_cap}).",
+            ephemeral=True
         )
 
-        # Fetch and format rank/tier
-        profile = user_data.get(str(user.id), {})
-        rank_code = profile.get("rank", "n/a")
-        tier_code = profile.get("tier", "n/a")
-        from_rank = RANK_NAMES.get(rank_code, "Unranked")
-        from_tier = tier_code.capitalize() if tier_code != "n/a" else None
-        rank_display = f"{from_rank} {from_tier}" if from_tier else from_rank
+    # Prevent duplicates (one game per player)
+    if user.id in game['player_ids']:
+        return await send_response(interaction,
+            "You're already in this match.", ephemeral=True
+        )
+    if user.id in player_games:
+        return await send_response(interaction,
+            "You're already in another match. Use `/leave` first.", ephemeral=True
+        )
+
+    if not add_game_player(host_id, user.id, display_name):
+        return await send_response(interaction,
+            "Sorry, that seat was just taken. Try again.", ephemeral=True
+        )
+    player_count = len(game['players'])
+
+    # Queue the thread/embed/log work (in join order) before acknowledging: the
+    # seat is taken, so it must follow even if the interaction expired (10062)
+    game_actions.enqueue(
+        host_id, announce_join, interaction.guild, host_id, game['thread_id'],
+        user, display_name, player_count, player_cap
+    )
+    await send_response(interaction, "You've joined the league!", ephemeral=True)
+
+
+async def announce_join(
+    guild: discord.Guild,
+    host_id: int,
+    thread_id: int,
+    user: discord.Member,
+    display_name: str,
+    player_count: int,
+    player_cap: int
+):
+    thread = guild.get_thread(thread_id)
+    if thread:
+        await rest.call(PRIORITY_STATE, f"thread.members:{thread.id}", thread.add_user, user)
 
-        # Send join embed
-        join_embed = discord.Embed(
+    profile = player_profile(user)
+
+    # Send join embed
+    join_embed = discord.Embed(
+        description=(
+            f"{user.mention} has joined the match!\n"
+            f"Display Name: {display_name}\n"
+            f"Rank: {profile.rank_display}\n"
+            f"Region: {profile.region or 'Not specified'}"
+        ), color=discord.Color.blue()
+    )
+    if thread:
+        await rest.call(PRIORITY_STATE, f"channel.send:{thread.id}", thread.send, embed=join_embed)
+
+    # Update footer of the welcome message
+    welcome_updater.schedule(guild, host_id)
+
+    # Log join event
+    log_channel = guild.get_channel(1357869099958403072)
+    if log_channel:
+        timestamp = datetime.datetime.now().strftime("%A %d %B %Y at %H:%M")
+        log_embed = discord.Embed(
+            title="Player Join Log",
             description=(
-                f"{user.mention} has joined the match!\n"
-                f"Display Name: {display_name}\n"
-                f"Rank: {rank_display}\n"
-                f"Region: {region_role}"
-            ), color=discord.Color.blue()
+                f"**Player:** {user.mention} (`{user.display_name}`)\n"
+                f"**IGN:** `{profile.ign or 'Unknown IGN'}`\n"
+                f"**Region:** `{profile.region or 'Unknown'}`\n"
+                f"**Host:** <@{host_id}>\n"
+                f"**Thread:** <#{thread_id}>"
+            ), color=discord.Color.green()
         )
-        if thread:
-            await thread.send(embed=join_embed)
-
-        # Update footer of first thread message
-        if thread:
-            first_msg = None
-            async for msg in thread.history(limit=1, oldest_first=True):
-                first_msg = msg
-                break
-            if first_msg and first_msg.embeds and first_msg.embeds[0].footer:
-                footer = first_msg.embeds[0].footer.text
-                if footer.startswith("Players:"):
-                    updated = first_msg.embeds[0]
-                    updated.set_footer(text=f"Players: {len(game['players'])}/{self.player_cap}")
-                    try:
-                        await first_msg.edit(embed=updated)
-                    except Exception as e:
-                        print(f"[Error updating player count embed] {e}")
-
-        # Log join event
-        log_channel = interaction.guild.get_channel(1357869099958403072)
-        if log_channel:
-            ign = user_data.get(str(user.id), {}).get("display_name", "Unknown IGN")
-            timestamp = datetime.datetime.now().strftime("%A %d %B %Y at %H:%M")
-            region_log = next(
-                (r.name for r in user.roles if r.name.upper() in ["NA","EU","SA","ASIA","OCE","AF"]),
-                "Unknown"
-            )
-            log_embed = discord.Embed(
-                title="Player Join Log",
-                description=(
-                    f"**Player:** {user.mention} (`{user.display_name}`)\n"
-                    f"**IGN:** `{ign}`\n"
-                    f"**Region:** `{region_log}`\n"
-                    f"**Host:** <@{self.host_id}>\n"
-                    f"**Thread:** <#{self.thread_id}>"
-                ), color=discord.Color.green()
-            )
-            log_embed.set_footer(text=f"Players: {len(game['players'])}/{self.player_cap} • {timestamp}")
-            await log_channel.send(embed=log_embed)
+        log_embed.set_footer(text=f"Players: {player_count}/{player_cap} • {timestamp}")
+        audit_log.post(log_channel, log_embed)
 
-        return await interaction.response.send_message("You've joined the league!", ephemeral=True)
+    if player_count == player_cap:
+        await post_team_split(guild, host_id)
+
+
+async def join_league(interaction: discord.Interaction, host_id: int, thread_id: Optional[int] = None):
+    sync_shared_state()
+    user = interaction.user
+    game = active_games.get(host_id)
+    # The thread id guards against an old button of a host who has since hosted again
+    if not game or (thread_id is not None and game['thread_id'] != thread_id):
+        return await send_response(interaction, "Match no longer exists.", ephemeral=True)
+
+    # Capacity check
+    if len(game['players']) >= game['player_cap']:
+        return await send_response(interaction,
+            f"Sorry, this match is full ({len(game['players'])}/{game['player_cap']}).", ephemeral=True
+        )
+    # Duplicate check
+    if user.id in game['player_ids']:
+        return await send_response(interaction, "You're already in.", ephemeral=True)
+    if user.id in player_games:
+        return await send_response(interaction,
+            "You're already in another match. Use `/leave` first.", ephemeral=True
+        )
+
+    # Display name modal if needed
+    profile = user_data.get(str(user.id), {})
+    display_name = profile.get("display_name")
+    if not display_name or not display_name.strip():
+        return await send_modal(interaction, LeagueNameModal(host_id, user))
+
+    await admit_player(interaction, host_id, user, display_name.strip())
 
-    @button(label="Join League", style=discord.ButtonStyle.primary, custom_id="join_league")
-    async def join(
-        self, interaction: discord.Interaction, button: discord.ui.Button
-    ):
-        user = interaction.user
-        game = active_games.get(self.host_id)
-        if not game:
-            return await interaction.response.send_message("Match no longer exists.", ephemeral=True)
 
-        # Capacity check
-        if len(game['players']) >= self.player_cap:
-            return await interaction.response.send_message(
-                f"Sorry, this match is full ({len(game['players'])}/{self.player_cap}).", ephemeral=True
+class JoinLeagueButton(discord.ui.DynamicItem[discord.ui.Button], template=r"prl:join:(?P<host_id>[0-9]+):(?P<thread_id>[0-9]+)"):
+    """Join button whose custom id carries the lobby; one handler serves every lobby.
+
+    Nothing is kept per lobby: the item is rebuilt from the custom id on each
+    click and the game is looked up in ``active_games``, so buttons keep
+    working across restarts without registering anything per game.
+    """
+
+    def __init__(self, host_id: int, thread_id: int):
+        super().__init__(
+            discord.ui.Button(
+                label="Join League",
+                style=discord.ButtonStyle.primary,
+                custom_id=f"prl:join:{host_id}:{thread_id}"
             )
-        # Duplicate check
-        if any(p['id'] == user.id for p in game['players']):
-            return await interaction.response.send_message("You're already in.", ephemeral=True)
+        )
+        self.host_id = host_id
+        self.thread_id = thread_id
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match: re.Match[str]):
+        return cls(int(match["host_id"]), int(match["thread_id"]))
+
+    async def callback(self, interaction: discord.Interaction):
+        async with traced_interaction("button:join_league", interaction):
+            await join_league(interaction, self.host_id, self.thread_id)
+
+
+class LegacyJoinButton(discord.ui.DynamicItem[discord.ui.Button], template=r"join_league"):
+    """Routes the fixed ``join_league`` id on lobbies posted before dynamic buttons."""
+
+    def __init__(self):
+        super().__init__(discord.ui.Button(label="Join League", custom_id="join_league"))
 
-        # Display name modal if needed
-        profile = user_data.get(str(user.id), {})
-        display_name = profile.get("display_name")
-        if not display_name or not display_name.strip():
-            return await interaction.response.send_modal(LeagueNameModal(self, user))
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match: re.Match[str]):
+        return cls()
+
+    async def callback(self, interaction: discord.Interaction):
+        async with traced_interaction("button:join_league_legacy", interaction):
+            await self._join(interaction)
+
+    async def _join(self, interaction: discord.Interaction):
+        message_id = interaction.message.id if interaction.message else None
+        host_id = next(
+            (h for h, g in active_games.items() if message_id and g.get("hosting_msg_id") == message_id),
+            None
+        )
+        if host_id is None:
+            return await send_response(interaction, "Match no longer exists.", ephemeral=True)
+        await join_league(interaction, host_id)
+
+
+def build_join_view(host_id: int, thread_id: int) -> View:
+    view = View(timeout=None)
+    view.add_item(JoinLeagueButton(host_id, thread_id))
+    return view
 
-        await self.add_player(interaction, user, display_name.strip())
 
 class LeagueNameModal(Modal, title="Enter Display Name"):
     display_name = TextInput(label="Display Name", placeholder="Enter your in-game name", max_length=32)
 
-    def __init__(self, view: LeagueView, user: discord.Member):
+    def __init__(self, host_id: int, user: discord.Member):
         super().__init__()
-        self.view = view
+        self.host_id = host_id
         self.user = user
 
     async def on_submit(self, interaction: discord.Interaction):
+        async with traced_interaction("modal:league_name", interaction):
+            await self._submit(interaction)
+
+    async def _submit(self, interaction: discord.Interaction):
         name = self.display_name.value.strip()
-        game = active_games.get(self.view.host_id)
-        thread = interaction.guild.get_thread(self.view.thread_id)
-        if game and (len(game['players']) >= self.view.player_cap or (thread and thread.member_count >= self.view.player_cap)):
-            return await interaction.response.send_message(
-                f"Sorry, match just filled ({len(game['players'])}/{self.view.player_cap}).", ephemeral=True
+        sync_shared_state()
+        game = active_games.get(self.host_id)
+        if game and len(game['players']) >= game['player_cap']:
+            return await send_response(interaction,
+                f"Sorry, match just filled ({len(game['players'])}/{game['player_cap']}).", ephemeral=True
             )
-        # Save to JSON and rewrite file
-        user_data[str(self.user.id)] = {"display_name": name}
-        with open(user_data_file, "w") as f:
-            json.dump(user_data, f, indent=2)
-        await self.view.add_player(interaction, self.user, name)
+        # Save display name (keeps any rank/tier already on the profile)
+        user_data.setdefault(str(self.user.id), {})["display_name"] = name
+        user_store.mark_dirty(self.user.id)
+        invalidate_profile(self.user.id)
+        await admit_player(interaction, self.host_id, self.user, name)
 
 # Example creation:
 player_caps = {"1s": 2, "2s": 4, "3s": 6, "4s": 8}
+GAMETYPE_DISPLAY = {"1s": "1v1", "2s": "2v2", "3s": "3v3", "4s": "4v4"}
+MATCHTYPE_DISPLAY = {"DL": "Default Loadout", "CL": "Custom Loadout", "RF": "Rank Format"}
+# Player-count changes inside this window are merged into one welcome-message edit
+FOOTER_UPDATE_INTERVAL = 1.5
 
 
-@bot.tree.command(name="prlhostleague", description="Host a league match.")
-@app_commands.choices(
-    gametype=[
-        app_commands.Choice(name="1v1", value="1s"),
-        app_commands.Choice(name="2v2", value="2s"),
-        app_commands.Choice(name="3v3", value="3s"),
-        app_commands.Choice(name="4v4", value="4s")
-    ],
-    matchtype=[
-        app_commands.Choice(name="Default Loadout", value="DL"),
-        app_commands.Choice(name="Custom Loadout", value="CL"),
-        app_commands.Choice(name="Rank Format", value="RF")
-    ],
-    region=[
-        app_commands.Choice(name="NA", value="NA"),
-        app_commands.Choice(name="EU", value="EU"),
-        app_commands.Choice(name="ASIA", value="ASIA"),
-        app_commands.Choice(name="OCE", value="OCE")
-    ]
-)
-async def prlhostleague(interaction: discord.Interaction, gametype: str, matchtype: str, region: str, link: str):
-    await interaction.response.defer(thinking=False, ephemeral=True)  # Stops the "bot is thinking..." message
-    guild = interaction.guild
-    host = interaction.user
-    category = interaction.channel
+def build_welcome_embed(host_id: int, game: dict) -> discord.Embed:
+    matchtype_display = MATCHTYPE_DISPLAY.get(game["matchtype"], game["matchtype"])
+    welcome_embed = discord.Embed(
+        description=(
+            f"Welcome <@{host_id}>\n"
+            "Use this thread to coordinate with players.\n"
+            "Type `/endleague` to close the match.\n\n"
+            f"Game details: **{matchtype_display}** {game['gametype']} - {game['region']}\n"
+            + (f"Join here: {game['link']}" if game.get("link") else "Matched from the queue: the host posts the lobby link here.")
+        ),
+        color=discord.Color.green()
+    )
+    welcome_embed.set_footer(text=f"Players: {len(game['players'])}/{game['player_cap']}")
+    return welcome_embed
+
+
+class WelcomeFooterUpdater:
+    """Keeps the "Players: x/y" footer of each lobby's welcome message current.
+
+    The message id is stored with the game, so an update is one partial-message
+    edit (no ``thread.history`` fetch), and bursts of joins/leaves inside the
+    interval collapse into a single edit rendered from the latest state.
+    """
+
+    def __init__(self, interval: float = FOOTER_UPDATE_INTERVAL):
+        self.interval = interval
+        self._pending: dict[int, asyncio.Task] = {}
+        self.stats = {"requested": 0, "merged": 0, "edits": 0}
+
+    def schedule(self, guild: discord.Guild, host_id: int):
+        self.stats["requested"] += 1
+        task = self._pending.get(host_id)
+        if task and not task.done():
+            self.stats["merged"] += 1
+            return
+        self._pending[host_id] = asyncio.create_task(self._update_later(guild, host_id))
 
-    player_caps = {"1s": 2, "2s": 4, "3s": 6, "4s": 8}
+    async def _update_later(self, guild: discord.Guild, host_id: int):
+        await asyncio.sleep(self.interval)
+        self._pending.pop(host_id, None)
+        game = active_games.get(host_id)
+        if not game or not game.get("welcome_msg_id"):
+            return
+        thread = guild.get_thread(game["thread_id"])
+        if not thread:
+            return
+        try:
+            message = thread.get_partial_message(game["welcome_msg_id"])
+            await rest.call(PRIORITY_COSMETIC, f"message.edit:{thread.id}", message.edit,
+                            embed=build_welcome_embed(host_id, game))
+            self.stats["edits"] += 1
+        except Exception as e:
+            print(f"[Error updating player count embed] {e}")
+
+
+welcome_updater = WelcomeFooterUpdater()
+
+
+GAMETYPE_CHOICES = [
+    app_commands.Choice(name="1v1", value="1s"),
+    app_commands.Choice(name="2v2", value="2s"),
+    app_commands.Choice(name="3v3", value="3s"),
+    app_commands.Choice(name="4v4", value="4s")
+]
+MATCHTYPE_CHOICES = [
+    app_commands.Choice(name="Default Loadout", value="DL"),
+    app_commands.Choice(name="Custom Loadout", value="CL"),
+    app_commands.Choice(name="Rank Format", value="RF")
+]
+REGION_CHOICES = [
+    app_commands.Choice(name="NA", value="NA"),
+    app_commands.Choice(name="EU", value="EU"),
+    app_commands.Choice(name="ASIA", value="ASIA"),
+    app_commands.Choice(name="OCE", value="OCE")
+]
+
+
+async def create_league(
+    guild: discord.Guild,
+    channel: discord.TextChannel,
+    host: discord.Member,
+    gametype: str,
+    matchtype: str,
+    region: str,
+    link: Optional[str],
+    players: tuple = ()
+) -> Optional[dict]:
+    """Open a lobby: private thread, welcome message, match-hosting post and log.
+
+    ``players`` are seated right away (lobbies formed by the queue). Anyone
+    who got into another game while the thread was being created is left
+    out, and the Join button is posted whenever seats are still open.
+    """
     player_cap = player_caps.get(gametype, 8)
 
-    thread = await category.create_thread(
+    thread = await rest.call(
+        PRIORITY_STATE, f"channel.threads:{channel.id}", channel.create_thread,
         name=f"League ({gametype}) - ({region}) - ({matchtype}) - {host.name}",
         type=discord.ChannelType.private_thread,
         invitable=False
     )
 
-    await thread.add_user(host)
-
-    # Save game data
-    active_games[host.id] = {
+    # No await between this check and register_game, so nobody ends up in two games
+    seated = [m for m in (host, *players) if m.id not in player_games and m.id not in active_games]
+    if not seated:
+        await rest.call(PRIORITY_STATE, f"channel.edit:{thread.id}", thread.edit, locked=True, archived=True)
+        return None
+    host = seated[0]
+    registered = register_game(host.id, {
         "thread_id": thread.id,
         "gametype": gametype,
         "matchtype": matchtype,
         "region": region,
         "link": link,
         "player_cap": player_cap,
-        "players": [{"id": host.id, "display_name": host.display_name or host.name}],
+        "players": [{"id": host.id, "display_name": host.display_name or host.name}] + [
+            {"id": m.id, "display_name": player_profile(m).ign or m.display_name} for m in seated[1:]
+        ],
         "start_time": datetime.datetime.now()
-    }
-
-    gametype_display = {"1s": "1v1", "2s": "2v2", "3s": "3v3", "4s": "4v4"}.get(gametype, gametype)
-    matchtype_display = {"DL": "Default Loadout", "CL": "Custom Loadout", "RF": "Rank Format"}.get(matchtype, matchtype)
-    formatted_time = datetime.datetime.now().strftime("%A %d %B %Y at %H:%M")
-    # Welcome embed
-    welcome_embed = discord.Embed(
-        description=(
-            f"Welcome {host.mention}\n"
-            "Use this thread to coordinate with players.\n"
-            "Type `/endleague` to close the match.\n\n"
-            f"Game details: **{matchtype_display}** {gametype} - {region}\n"
-            f"Join here: {link}"
-        ),
-        color=discord.Color.green()
-    )
-    welcome_embed.set_footer(text=f"Players: 1/{player_cap}")
-    thread_msg = await thread.send(embed=welcome_embed)
+    })
+    if not registered:
+        # Lost a seat to another shard process in the meantime
+        await rest.call(PRIORITY_STATE, f"channel.edit:{thread.id}", thread.edit, locked=True, archived=True)
+        return None
+    for member in seated:
+        matchmaker.remove(member.id)
+    game = active_games[host.id]
+    for member in seated:
+        await rest.call(PRIORITY_STATE, f"thread.members:{thread.id}", thread.add_user, member)
+
+    # Welcome embed; its id is kept so footer updates can edit it directly
+    thread_msg = await rest.call(PRIORITY_STATE, f"channel.send:{thread.id}", thread.send,
+                                 embed=build_welcome_embed(host.id, game))
+    update_game(host.id, welcome_msg_id=thread_msg.id)
 
     # Display names
-    gametype_display = {"1s": "1v1", "2s": "2v2", "3s": "3v3", "4s": "4v4"}.get(gametype, gametype)
-    matchtype_display = {"DL": "Default Loadout", "CL": "Custom Loadout", "RF": "Rank Format"}.get(matchtype, matchtype)
+    gametype_display = GAMETYPE_DISPLAY.get(gametype, gametype)
+    matchtype_display = MATCHTYPE_DISPLAY.get(matchtype, matchtype)
     formatted_time = datetime.datetime.now().strftime("%A %d %B %Y at %H:%M")
 
     # Styled embed for match-hosting
@@ -294,19 +2605,18 @@ async def prlhostleague(interaction: discord.Interaction, gametype: str, matchty
     )
     styled_embed.set_footer(text=formatted_time)
 
-    # Send to match-hosting channel
+    # Send to match-hosting channel while there are seats to fill
     match_hosting_channel = guild.get_channel(1354174076998127873)
-    if match_hosting_channel:
-       leagues_role_id = 1354174067715997954
-       await match_hosting_channel.send(
-           content=f"<@&{leagues_role_id}>",
-          embed=styled_embed,
-          view=LeagueView(host.id, thread.id, None, thread_msg.id, gametype, matchtype, region, player_cap),
-          allowed_mentions=discord.AllowedMentions(roles=True)
-      )
-
-    await interaction.followup.send("Your league Match have been hosted.")
-        
+    if match_hosting_channel and len(game["players"]) < player_cap:
+        leagues_role_id = 1354174067715997954
+        hosting_msg = await rest.call(
+            PRIORITY_STATE, f"channel.send:{match_hosting_channel.id}", match_hosting_channel.send,
+            content=f"<@&{leagues_role_id}>",
+            embed=styled_embed,
+            view=build_join_view(host.id, thread.id),
+            allowed_mentions=discord.AllowedMentions(roles=True)
+        )
+        update_game(host.id, hosting_msg_id=hosting_msg.id)
 
     log_channel = guild.get_channel(1357869099958403072)
     if log_channel:
@@ -317,11 +2627,244 @@ async def prlhostleague(interaction: discord.Interaction, gametype: str, matchty
                 f"**Mode:** `{gametype_display}`\n"
                 f"**Format:** `{matchtype_display}`\n"
                 f"**Thread:** {thread.mention}"
+                + (f"\n**Matched:** {len(seated)}/{player_cap} from the queue" if players else "")
             ),
             color=discord.Color.green()
         )
         log_embed.set_footer(text=f"Thread ID: {thread.id}")
-        await log_channel.send(embed=log_embed)
+        audit_log.post(log_channel, log_embed)
+
+    if len(game["players"]) == player_cap:
+        game_actions.enqueue(host.id, post_team_split, guild, host.id)
+    return game
+
+
+@bot.tree.command(name="prlhostleague", description="Host a league match.")
+@app_commands.choices(gametype=GAMETYPE_CHOICES, matchtype=MATCHTYPE_CHOICES, region=REGION_CHOICES)
+async def prlhostleague(interaction: discord.Interaction, gametype: str, matchtype: str, region: str, link: str):
+    if interaction.user.id in player_games or interaction.user.id in active_games:
+        return await send_response(interaction,
+            "You're already in a league match. Use `/leave` or `/endleague` first.", ephemeral=True
+        )
+    await defer_response(interaction, thinking=False, ephemeral=True)  # Stops the "bot is thinking..." message
+    if not await create_league(interaction.guild, interaction.channel, interaction.user, gametype, matchtype, region, link):
+        return await send_followup(interaction,
+            "You're already in a league match. Use `/leave` or `/endleague` first.", ephemeral=True
+        )
+    await send_followup(interaction, "Your league Match have been hosted.")
+
+
+# ——— Team balance ———
+def _team_splits(n: int) -> tuple:
+    """Every way to pick the first team of an n-player lobby (team sizes n//2 and the rest).
+
+    For even n, player 0 is pinned to the first team so mirrored splits
+    aren't tried twice: 4v4 is 35 candidates.
+    """
+    return tuple(
+        tuple(i for i in range(n) if mask >> i & 1)
+        for mask in range(1 << n)
+        if bin(mask).count("1") == n // 2 and (mask & 1 or n % 2)
+    )
+
+
+# Precomputed once; a split is a min() over at most 70 candidates
+TEAM_SPLITS = {n: _team_splits(n) for n in range(2, 9)}
+
+
+def skill_score(rank: Optional[str], tier: Optional[str]) -> int:
+    """R1 Low = 3 up to R11 High = 35; no tier counts as Mid, unranked as 1."""
+    if rank not in RANK_POSITION:
+        return 1
+    level = len(RANK_ORDER) - RANK_POSITION[rank]
+    return level * 3 + TIER_ORDER.get(tier, 1)
+
+
+def balance_teams(scores: list[int]) -> Optional[tuple[tuple, tuple, int]]:
+    """Split that minimises the score difference: (team 1 indexes, team 2 indexes, difference)."""
+    splits = TEAM_SPLITS.get(len(scores))
+    if not splits:
+        return None
+    total = sum(scores)
+    best = min(splits, key=lambda team: abs(total - 2 * sum(scores[i] for i in team)))
+    rest_of_lobby = tuple(i for i in range(len(scores)) if i not in best)
+    return best, rest_of_lobby, abs(total - 2 * sum(scores[i] for i in best))
+
+
+async def build_team_split_embed(guild: discord.Guild, game: dict) -> Optional[discord.Embed]:
+    players = game["players"]
+    profiles = []
+    for player in players:
+        member = await resolve_member(guild, player["id"])
+        profiles.append(player_profile(member) if member else PlayerProfile.stored(player["id"]))
+    split = balance_teams([skill_score(p.rank, p.tier) for p in profiles])
+    if split is None:
+        return None
+    team_one, team_two, difference = split
+
+    def roster(team):
+        return "\n".join(f"<@{players[i]['id']}> - {profiles[i].rank_display}" for i in team)
+
+    embed = discord.Embed(title="Balanced Teams", color=discord.Color.gold())
+    embed.add_field(name="Team 1", value=roster(team_one), inline=True)
+    embed.add_field(name="Team 2", value=roster(team_two), inline=True)
+    embed.set_footer(text=f"Rank score difference: {difference}")
+    return embed
+
+
+async def post_team_split(guild: discord.Guild, host_id: int):
+    """Post the balanced split in a Rank Format lobby once it's full (runs in the game's action queue)."""
+    game = active_games.get(host_id)
+    if not game or game["matchtype"] != "RF" or len(game["players"]) < game["player_cap"]:
+        return
+    thread = guild.get_thread(game["thread_id"])
+    embed = await build_team_split_embed(guild, game)
+    if thread and embed:
+        await rest.call(PRIORITY_STATE, f"channel.send:{thread.id}", thread.send, embed=embed)
+
+
+@bot.tree.command(name="balance", description="Split your league lobby into rank-balanced teams.")
+async def balance(interaction: discord.Interaction):
+    host_id = player_games.get(interaction.user.id)
+    game = active_games.get(host_id)
+    if not game:
+        return await send_response(interaction, "You are not part of any active league.", ephemeral=True)
+    if len(game["players"]) < 2:
+        return await send_response(interaction, "Need at least two players to split into teams.", ephemeral=True)
+    await defer_response(interaction)
+    embed = await build_team_split_embed(interaction.guild, game)
+    await send_followup(interaction, embed=embed)
+
+
+# ——— Matchmaking queue ———
+# Rank Format buckets span this many adjacent ranks: r11-r9, r8-r6, r5-r3, r2-r1
+RF_BAND_WIDTH = 3
+
+
+class MatchQueue:
+    """Players waiting for a match, bucketed by (region, gametype, matchtype, rank band).
+
+    Each bucket is a heap ordered by queue time. Leaving only marks the
+    entry dead (it's skipped when it surfaces), so queueing, leaving and
+    taking a lobby's worth of players stay O(log n) per player however many
+    are waiting. Players taken for a lobby that then fails to open go back
+    in at their old position.
+    """
+
+    def __init__(self):
+        self.buckets: dict[tuple, list] = {}
+        self.live: dict[tuple, int] = {}
+        self.entries: dict[int, list] = {}  # user id -> [seq, user id, member, bucket, alive]
+        self._seq = itertools.count()
+
+    @staticmethod
+    def bucket_for(member: discord.Member, gametype: str, matchtype: str, region: str) -> tuple:
+        band = None
+        if matchtype == "RF":
+            rank = player_profile(member).rank
+            band = RANK_POSITION.get(rank, len(RANK_ORDER) - 1) // RF_BAND_WIDTH
+        return (region, gametype, matchtype, band)
+
+    def add(self, member: discord.Member, bucket: tuple, seq: Optional[int] = None):
+        entry = [next(self._seq) if seq is None else seq, member.id, member, bucket, True]
+        self.entries[member.id] = entry
+        heapq.heappush(self.buckets.setdefault(bucket, []), entry)
+        self.live[bucket] = self.live.get(bucket, 0) + 1
+
+    def remove(self, user_id: int) -> Optional[tuple]:
+        entry = self.entries.pop(user_id, None)
+        if entry is None:
+            return None
+        entry[4] = False
+        bucket = entry[3]
+        self.live[bucket] -= 1
+        heap = self.buckets[bucket]
+        if len(heap) > 2 * self.live[bucket] + 64:
+            # Mostly dead entries: rebuild once, amortised O(1) per leave
+            heap[:] = [e for e in heap if e[4]]
+            heapq.heapify(heap)
+        return bucket
+
+    def take(self, bucket: tuple, n: int) -> list:
+        """Pop the ``n`` longest-waiting players of a bucket (caller checks ``live``)."""
+        heap = self.buckets[bucket]
+        taken = []
+        while heap and len(taken) < n:
+            entry = heapq.heappop(heap)
+            if entry[4]:
+                del self.entries[entry[1]]
+                taken.append(entry)
+        self.live[bucket] -= len(taken)
+        if not heap:
+            del self.buckets[bucket]
+            del self.live[bucket]
+        return taken
+
+    def requeue(self, taken: list):
+        for seq, user_id, member, bucket, _ in taken:
+            if user_id not in self.entries and user_id not in player_games and user_id not in active_games:
+                self.add(member, bucket, seq)
+
+    def describe(self, bucket: tuple) -> str:
+        region, gametype, matchtype, band = bucket
+        text = f"{GAMETYPE_DISPLAY.get(gametype, gametype)} {MATCHTYPE_DISPLAY.get(matchtype, matchtype)} ({region})"
+        if band is not None:
+            high = RANK_ORDER[band * RF_BAND_WIDTH]
+            low = RANK_ORDER[min(len(RANK_ORDER), (band + 1) * RF_BAND_WIDTH) - 1]
+            text += f", {low.upper()}-{high.upper()}"
+        return text
+
+
+matchmaker = MatchQueue()
+
+
+async def open_matched_league(guild: discord.Guild, channel: discord.TextChannel, bucket: tuple, taken: list):
+    region, gametype, matchtype, _ = bucket
+    members = [entry[2] for entry in taken]
+    try:
+        if not await create_league(guild, channel, members[0], gametype, matchtype, region, None, tuple(members[1:])):
+            matchmaker.requeue(taken)  # whoever is still unseated waits for the next lobby
+    except Exception as e:
+        print(f"[Error opening matched league] {e}")
+        matchmaker.requeue(taken)
+
+
+@bot.tree.command(name="queue", description="Queue for a league match; a lobby opens once enough players wait.")
+@app_commands.choices(gametype=GAMETYPE_CHOICES, matchtype=MATCHTYPE_CHOICES, region=REGION_CHOICES)
+@app_commands.describe(region="Defaults to your region role")
+async def queue(interaction: discord.Interaction, gametype: str, matchtype: str, region: Optional[str] = None):
+    user = interaction.user
+    if user.id in player_games or user.id in active_games:
+        return await send_response(interaction,
+            "You're already in a league match. Use `/leave` or `/endleague` first.", ephemeral=True
+        )
+    if user.id in matchmaker.entries:
+        return await send_response(interaction,
+            "You're already queued. Use `/leavequeue` first.", ephemeral=True
+        )
+    region = region or player_profile(user).region
+    if not region:
+        return await send_response(interaction, "Pick a region (you don't have a region role).", ephemeral=True)
+
+    bucket = matchmaker.bucket_for(user, gametype, matchtype, region)
+    matchmaker.add(user, bucket)
+    player_cap = player_caps.get(gametype, 8)
+    waiting = matchmaker.live[bucket]
+    if waiting >= player_cap:
+        taken = matchmaker.take(bucket, player_cap)
+        asyncio.create_task(open_matched_league(interaction.guild, interaction.channel, bucket, taken))
+        return await send_response(interaction, "Match found! Your lobby thread is being created.", ephemeral=True)
+    await send_response(interaction,
+        f"Queued for {matchmaker.describe(bucket)}: {waiting}/{player_cap} players waiting.", ephemeral=True
+    )
+
+
+@bot.tree.command(name="leavequeue", description="Leave the matchmaking queue.")
+async def leavequeue(interaction: discord.Interaction):
+    bucket = matchmaker.remove(interaction.user.id)
+    if bucket is None:
+        return await send_response(interaction, "You're not in the queue.", ephemeral=True)
+    await send_response(interaction, f"You left the {matchmaker.describe(bucket)} queue.", ephemeral=True)
 
 
 @bot.tree.command(name="add", description="Add a user to the league thread (host only).")
@@ -331,35 +2874,33 @@ async def add(interaction: discord.Interaction, member: discord.Member):
     game_info = active_games.get(host_id)
 
     if not game_info:
-        await interaction.response.send_message("You are not hosting any league match.", ephemeral=True)
+        await send_response(interaction, "You are not hosting any league match.", ephemeral=True)
         return
 
     thread = interaction.guild.get_thread(game_info["thread_id"])
     if not thread:
-        await interaction.response.send_message("The league has ended or the thread is unavailable.", ephemeral=True)
+        await send_response(interaction, "The league has ended or the thread is unavailable.", ephemeral=True)
         return
 
     if len(game_info["players"]) >= game_info["player_cap"]:
-        await interaction.response.send_message("The league is full and cannot accept more players.", ephemeral=True)
+        await send_response(interaction, "The league is full and cannot accept more players.", ephemeral=True)
         return
 
-    # Check if the member is already in the league
-    if any(player["id"] == member.id for player in game_info["players"]):
-        await interaction.response.send_message(f"{member.mention} is already in the league!", ephemeral=True)
+    # Check if the member is already in the league (or in another one)
+    if member.id in game_info["player_ids"]:
+        await send_response(interaction, f"{member.mention} is already in the league!", ephemeral=True)
+        return
+    if member.id in player_games:
+        await send_response(interaction, f"{member.mention} is already in another league!", ephemeral=True)
         return
 
     # Add the player to the league and update game_info
-    game_info["players"].append({"id": member.id, "display_name": member.display_name or member.name})
-    await thread.add_user(member)
-
-    # Retrieve the player's roles first
-    region_role = None
-    for role in member.roles:
-        if role.name in ["NA", "EU", "ASIA", "OCE"]:
-            region_role = role.name
-            break
+    if not add_game_player(host_id, member.id, member.display_name or member.name):
+        await send_response(interaction, f"Couldn't add {member.mention}: the league filled up or they just joined another one.", ephemeral=True)
+        return
+    await rest.call(PRIORITY_STATE, f"thread.members:{thread.id}", thread.add_user, member)
 
-    rank_role = next((role.name for role in member.roles if role.name in ["Gold", "Platinum", "Diamond", "Unranked"]), "Unranked")
+    profile = player_profile(member)
 
     # Send the player embed with their information in the thread
     player_embed = discord.Embed(
@@ -367,39 +2908,24 @@ async def add(interaction: discord.Interaction, member: discord.Member):
         description=f"{member.mention} has joined the league!",
         color=discord.Color.blue()
     )
-    player_embed.add_field(name="Region", value=(region_role if region_role else "Not specified"), inline=True)
-    player_embed.add_field(name="Rank", value=rank_role, inline=True)
+    player_embed.add_field(name="Region", value=profile.region or "Not specified", inline=True)
+    player_embed.add_field(name="Rank", value=profile.rank_display, inline=True)
     player_embed.set_footer(text=f"Players: {len(game_info['players'])}/{game_info['player_cap']}")
-    await thread.send(embed=player_embed)
+    await rest.call(PRIORITY_STATE, f"channel.send:{thread.id}", thread.send, embed=player_embed)
 
     # Update the welcome message to reflect the updated player count
-    async for msg in thread.history(limit=100, oldest_first=True):
-        if msg.embeds:
-            embed = msg.embeds[0]
-            if embed.footer and "Players:" in embed.footer.text:
-                updated_embed = embed.copy()
-                updated_embed.set_footer(text=f"Players: {len(game_info['players'])}/{game_info['player_cap']}")
-                await msg.edit(embed=updated_embed)
-                break
+    welcome_updater.schedule(interaction.guild, host_id)
 
     log_channel = interaction.guild.get_channel(1357869099958403072)
     if log_channel:
-        uid = str(member.id)
-        ign = user_data.get(uid, {}).get("display_name", "Unknown IGN")
         formatted_time = datetime.datetime.now().strftime("%A %d %B %Y at %H:%M")
 
-        # Detect player region from roles
-        region_role = next(
-            (role.name for role in member.roles if role.name.upper() in ["NA", "EU", "ASIA", "OCE",]),
-            "Unknown Region"
-        )
-
         log_embed = discord.Embed(
             title="**Player Add Log**",
             description=(
                 f"**Player:** {member.mention} (`{member.display_name}`)\n"
-                f"**IGN:** `{ign}`\n"
-                f"**Region:** `{region_role}`\n"
+                f"**IGN:** `{profile.ign or 'Unknown IGN'}`\n"
+                f"**Region:** `{profile.region or 'Unknown Region'}`\n"
                 f"**Host:** {interaction.user.mention}\n"
                 f"**Thread:** {thread.mention}"
             ),
@@ -410,73 +2936,59 @@ async def add(interaction: discord.Interaction, member: discord.Member):
             text=f"Players: {len(game_info['players'])}/{game_info['player_cap']} • Thread ID: {thread.id} • {formatted_time}"
         )
 
-        await log_channel.send(embed=log_embed)
+        audit_log.post(log_channel, log_embed)
 
     if len(game_info["players"]) == game_info["player_cap"]:
-        await thread.send("The League is Now Full!")
+        await rest.call(PRIORITY_STATE, f"channel.send:{thread.id}", thread.send, "The League is Now Full!")
+        game_actions.enqueue(host_id, post_team_split, interaction.guild, host_id)
 
 
 @bot.tree.command(name="leave", description="Leave the league and remove yourself from the thread.")
 async def leave(interaction: discord.Interaction):
     user = interaction.user
-    host_id = None
-    game_info = None
 
     # Find the game the user is in
-    for host, game in active_games.items():
-        if any(player["id"] == user.id for player in game["players"]):
-            host_id = host
-            game_info = game
-            break
+    host_id = player_games.get(user.id)
+    game_info = active_games.get(host_id)
 
     if not game_info:
-        await interaction.response.send_message("You are not part of any active league.", ephemeral=True)
+        await send_response(interaction, "You are not part of any active league.", ephemeral=True)
         return
 
     # Remove player from the game (including the host)
-    game_info["players"] = [player for player in game_info["players"] if player["id"] != user.id]
+    if not remove_game_player(host_id, user.id):
+        await send_response(interaction, "Couldn't leave the league right now. Try again.", ephemeral=True)
+        return
 
     thread = interaction.guild.get_thread(game_info["thread_id"])
     if thread:
         try:
-            await thread.remove_user(user)
+            await rest.call(PRIORITY_STATE, f"thread.members:{thread.id}", thread.remove_user, user)
 
             # Update the welcome message
-            async for msg in thread.history(limit=10, oldest_first=True):
-                if msg.embeds and msg.embeds[0].footer and msg.embeds[0].footer.text.startswith("Players:"):
-                    updated_embed = msg.embeds[0]
-                    updated_embed.set_footer(text=f"Players: {len(game_info['players'])}/{game_info['player_cap']}")
-                    await msg.edit(embed=updated_embed)
-                    break
+            welcome_updater.schedule(interaction.guild, host_id)
         except Exception as e:
             print(f"[Error removing player from thread] {e}")
-            await interaction.response.send_message("An error occurred while removing you from the thread.", ephemeral=True)
+            await send_response(interaction, "An error occurred while removing you from the thread.", ephemeral=True)
             return
     else:
-        await interaction.response.send_message("The league thread no longer exists or is inaccessible.", ephemeral=True)
+        await send_response(interaction, "The league thread no longer exists or is inaccessible.", ephemeral=True)
         return
 
-    await interaction.response.send_message(f"{user.mention}, you have left the league.", ephemeral=True)
+    await send_response(interaction, f"{user.mention}, you have left the league.", ephemeral=True)
 
 
     log_channel = interaction.guild.get_channel(1357869099958403072)
     if log_channel:
-        uid = str(user.id)
-        ign = user_data.get(uid, {}).get("display_name", "Unknown IGN")
+        profile = player_profile(user)
         formatted_time = datetime.datetime.now().strftime("%A %d %B %Y at %H:%M")
 
-    # Detect region from user's roles
-        region_role = next(
-            (role.name for role in user.roles if role.name.upper() in ["NA", "EU", "ASIA", "OCE"]),
-            "Unknown Region"
-        )
-
         log_embed = discord.Embed(
             title="**Player Leave Log**",
             description=(
                 f"**Player:** {user.mention} (`{user.display_name}`)\n"
-                f"**IGN:** `{ign}`\n"
-                f"**Region:** `{region_role}`\n"
+                f"**IGN:** `{profile.ign or 'Unknown IGN'}`\n"
+                f"**Region:** `{profile.region or 'Unknown Region'}`\n"
                 f"**Host:** <@{host_id}>\n"
                 f"**Thread:** {thread.mention if thread else 'N/A'}"
             ),
@@ -487,7 +2999,7 @@ async def leave(interaction: discord.Interaction):
             text=f"Players Remaining: {len(game_info['players'])}/{game_info['player_cap']} • Thread ID: {thread.id if thread else 'N/A'} • {formatted_time}"
        )
 
-        await log_channel.send(embed=log_embed)
+        audit_log.post(log_channel, log_embed)
 
 
 
@@ -499,60 +3011,47 @@ async def remove(interaction: discord.Interaction, member: discord.Member, reaso
     game_info = active_games.get(host_id)
 
     if not game_info:
-        await interaction.response.send_message("You are not hosting any league match.", ephemeral=True)
+        await send_response(interaction, "You are not hosting any league match.", ephemeral=True)
         return
 
-    if not any(player["id"] == member.id for player in game_info["players"]):
-        await interaction.response.send_message(f"{member.mention} is not in your league.", ephemeral=True)
+    if member.id not in game_info["player_ids"]:
+        await send_response(interaction, f"{member.mention} is not in your league.", ephemeral=True)
         return
 
     # Remove the player from the game
-    game_info["players"] = [player for player in game_info["players"] if player["id"] != member.id]
+    if not remove_game_player(host_id, member.id):
+        await send_response(interaction, f"Couldn't remove {member.mention} right now. Try again.", ephemeral=True)
+        return
 
     # Get the thread for the league
     thread = interaction.guild.get_thread(game_info["thread_id"])
     if thread:
         try:
-            await thread.remove_user(member)
+            await rest.call(PRIORITY_STATE, f"thread.members:{thread.id}", thread.remove_user, member)
 
             # Update the welcome message with the new player count
-            async for msg in thread.history(limit=10, oldest_first=True):
-                if msg.embeds and msg.embeds[0].footer and msg.embeds[0].footer.text.startswith("Players:"):
-                    updated_embed = msg.embeds[0]
-                    updated_embed.set_footer(text=f"Players: {len(game_info['players'])}/{game_info['player_cap']}")
-                    try:
-                        await msg.edit(embed=updated_embed)
-                    except Exception as e:
-                        print(f"[Error updating welcome embed] {e}")
-                    break
+            welcome_updater.schedule(interaction.guild, host_id)
         except Exception as e:
             print(f"[Error removing player from thread] {e}")
-            await interaction.response.send_message("An error occurred while removing the player from the thread.", ephemeral=True)
+            await send_response(interaction, "An error occurred while removing the player from the thread.", ephemeral=True)
             return
     else:
-        await interaction.response.send_message("The league thread no longer exists or is inaccessible.", ephemeral=True)
+        await send_response(interaction, "The league thread no longer exists or is inaccessible.", ephemeral=True)
         return
 
 
 
     log_channel = interaction.guild.get_channel(1357869099958403072)
     if log_channel:
-        uid = str(member.id)
-        ign = user_data.get(uid, {}).get("display_name", "Unknown IGN")
+        profile = player_profile(member)
         formatted_time = datetime.datetime.now().strftime("%A %d %B %Y at %H:%M")
 
-    # Detect region from user's roles
-        region_role = next(
-            (role.name for role in member.roles if role.name.upper() in ["NA", "EU", "ASIA", "OCE"]),
-            "Unknown Region"
-        )
-
         log_embed = discord.Embed(
             title="**Player Removed from League**",
             description=(
                 f"**Removed Player:** {member.mention} (`{member.display_name}`)\n"
-                f"**IGN:** `{ign}`\n"
-                f"**Region:** `{region_role}`\n"
+                f"**IGN:** `{profile.ign or 'Unknown IGN'}`\n"
+                f"**Region:** `{profile.region or 'Unknown Region'}`\n"
                 f"**Host:** {interaction.user.mention}\n"
                 f"**Thread:** {thread.mention if thread else 'N/A'}"
                 f"**Reason:** {reason}"
@@ -564,23 +3063,23 @@ async def remove(interaction: discord.Interaction, member: discord.Member, reaso
             text=f"Players Remaining: {len(game_info['players'])}/{game_info['player_cap']} • Thread ID: {thread.id if thread else 'N/A'} • {formatted_time}"
         )
 
-        await log_channel.send(embed=log_embed)
+        audit_log.post(log_channel, log_embed)
 
     # Confirm removal to the host
-    await interaction.response.send_message(f"{member.mention} has been removed from the league.", ephemeral=True)
+    await send_response(interaction, f"{member.mention} has been removed from the league.", ephemeral=True)
 
 
 
 
 @bot.tree.command(name="endleague", description="Ends your league and locks the thread.")
 async def endleague(interaction: discord.Interaction):
-    await interaction.response.defer(ephemeral=True)  # <- Responds immediately to avoid timeout
+    await defer_response(interaction, ephemeral=True)  # <- Responds immediately to avoid timeout
 
     host_id = interaction.user.id
     game_info = active_games.get(host_id)
 
     if not game_info:
-        await interaction.followup.send("You are not hosting any active league.")
+        await send_followup(interaction, "You are not hosting any active league.")
         return
 
     thread = interaction.guild.get_thread(game_info["thread_id"])
@@ -588,16 +3087,17 @@ async def endleague(interaction: discord.Interaction):
     # Lock and archive the thread
     if thread:
         try:
-            await thread.edit(locked=True, archived=True, reason="League ended by host via /endleague")
+            await rest.call(PRIORITY_STATE, f"channel.edit:{thread.id}", thread.edit,
+                            locked=True, archived=True, reason="League ended by host via /endleague")
         except Exception as e:
             print(f"[Error locking thread] {e}")
-            await interaction.followup.send("Failed to lock the thread. Please check permissions.")
+            await send_followup(interaction, "Failed to lock the thread. Please check permissions.")
             return
 
     # Clean up the game data
-    active_games.pop(host_id, None)
+    end_game(host_id)
 
-    await interaction.followup.send("Your league has been ended and the thread locked.")
+    await send_followup(interaction, "Your league has been ended and the thread locked.")
 
     # Log the event in the log channe
 
@@ -615,26 +3115,214 @@ async def endleague(interaction: discord.Interaction):
         log_embed.add_field(name="Thread", value=thread.mention if thread else "Thread not found", inline=True)
         log_embed.set_footer(text=f"Ended at: {formatted_time} | Thread ID: {thread.id if thread else 'N/A'}")
 
-        await log_channel.send(embed=log_embed)
-
+        audit_log.post(log_channel, log_embed)
 
-# ——— Persistence boilerplate ———
-user_data_file = "user_data_prl.json"
-try:
-    with open(user_data_file, "r") as f:
-        user_data = json.load(f)
-except FileNotFoundError:
-    user_data = {}
 
-active_strikes = user_data.get("strikes", {})
-
-def save_user_data(data):
-    with open(user_data_file, "w") as f:
-        json.dump(data, f, indent=2)
+# ——— Strike persistence ———
+active_strikes = user_data.setdefault("strikes", {})
+STRIKE_LIMIT = 3  # strikes of one kind that earn its role
+# Days until a single strike wears off (0 keeps it until /strikeremove)
+STRIKE_DECAY_DAYS = {
+    "host": float(os.getenv("PRL_HOST_STRIKE_DAYS", "30")),
+    "grief": float(os.getenv("PRL_GRIEF_STRIKE_DAYS", "30")),
+}
+STRIKE_TIMER_MAX_SLEEP = 3600  # re-check the heap at least hourly (clock jumps, suspend)
+
+def save_strike_data(user_id):
+    user_store.mark_dirty(user_id)
+
+def strike_expiry(kind: str) -> Optional[float]:
+    days = STRIKE_DECAY_DAYS[kind]
+    return time.time() + days * 86400 if days > 0 else None
+
+def strike_entry(data: Optional[dict]) -> dict:
+    """Copy of a stored strike entry with one expiry time (or None) per strike.
+
+    Entries saved before strikes expired only have counts; those strikes
+    get a full decay period starting now.
+    """
+    entry = _copy_records(data) if data else {}
+    expires = entry.setdefault("expires", {})
+    for kind in STRIKE_ROLES:
+        times = expires.setdefault(kind, [])
+        while len(times) < entry.get(kind, 0):
+            times.append(strike_expiry(kind))
+        entry[kind] = len(times)
+    return entry
+
+def change_strikes(user_id, change) -> tuple[dict, bool]:
+    """Apply ``change(entry) -> bool`` to a player's strikes and persist it.
+
+    With shared state the read, check and write are one database transaction.
+    """
+    user_id = str(user_id)
+    if shared_state:
+        try:
+            entry, applied = shared_state.update_strikes(user_id, change)
+        except sqlite3.Error as e:
+            # Locked by another process past the busy timeout; callers see "not applied"
+            print(f"[Error updating shared strikes for {user_id}] {e}")
+            return strike_entry(active_strikes.get(user_id)), False
+    else:
+        entry = strike_entry(active_strikes.get(user_id))
+        applied = change(entry)
+        if applied:
+            save_strike_data(user_id)
+    if applied or shared_state:
+        active_strikes[user_id] = entry
+    if applied:
+        strike_timers.schedule(user_id, entry)
+    return entry, applied
+
+def adjust_strike(user_id, kind: str, delta: int, guild_id: Optional[int] = None) -> tuple[dict, bool]:
+    """Move a player's ``kind`` strikes by ``delta``, kept within 0..STRIKE_LIMIT.
+
+    New strikes get an expiry time; a removal drops the most recent strike.
+    Returns the resulting entry and whether the change was applied.
+    """
+    def change(entry: dict) -> bool:
+        if not 0 <= entry[kind] + delta <= STRIKE_LIMIT:
+            return False
+        times = entry["expires"][kind]
+        if delta > 0:
+            times.extend(strike_expiry(kind) for _ in range(delta))
+            if guild_id:
+                entry["guild_id"] = guild_id
+        else:
+            del times[len(times) + delta:]
+        entry[kind] = len(times)
+        return True
+    return change_strikes(user_id, change)
+
+def owns_guild(guild_id: Optional[int]) -> bool:
+    """Whether this process runs the shard that gets ``guild_id``'s events."""
+    if not SHARD_IDS or not SHARD_COUNT:
+        return True
+    if guild_id is None:
+        return 0 in SHARD_IDS
+    return (guild_id >> 22) % SHARD_COUNT in SHARD_IDS
+
+
+class StrikeTimers:
+    """Min-heap of strike expiry times, rebuilt from the stored entries on start.
+
+    The loop sleeps until the earliest expiry (or until an earlier one is
+    scheduled), so each wake-up only touches the strikes that are due.
+    Entries aren't removed from the heap when a strike goes away early:
+    ``expire_strike`` checks the stored entry and skips stale ones.
+    """
+
+    def __init__(self):
+        self.heap: list[tuple[float, str, str]] = []   # (expires_at, user_id, kind)
+        self._scheduled: set[tuple[float, str, str]] = set()
+        self._wakeup = asyncio.Event()
+        self.stats = {"expired": 0, "roles_removed": 0}
+
+    def schedule(self, user_id: str, entry: dict):
+        if not owns_guild(entry.get("guild_id")):
+            return  # the process running that guild's shard expires it
+        earliest = self.heap[0][0] if self.heap else None
+        for kind, times in entry.get("expires", {}).items():
+            for ts in times:
+                key = (ts, user_id, kind)
+                if ts is not None and key not in self._scheduled:
+                    self._scheduled.add(key)
+                    heapq.heappush(self.heap, key)
+        if self.heap and self.heap[0][0] != earliest:
+            self._wakeup.set()
+
+    def rebuild(self) -> int:
+        # Older entries only have counts; give their strikes expiry times once
+        for user_id in [u for u, e in active_strikes.items() if "expires" not in e]:
+            change_strikes(user_id, lambda entry: True)
+        self._scheduled = {
+            (ts, user_id, kind)
+            for user_id, entry in active_strikes.items() if owns_guild(entry.get("guild_id"))
+            for kind, times in entry.get("expires", {}).items()
+            for ts in times if ts is not None
+        }
+        self.heap = list(self._scheduled)
+        heapq.heapify(self.heap)
+        return len(self.heap)
+
+    def due(self, now: float) -> list[tuple[float, str, str]]:
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            key = heapq.heappop(self.heap)
+            self._scheduled.discard(key)
+            due.append(key)
+        return due
+
+    async def run(self):
+        while True:
+            delay = self.heap[0][0] - time.time() if self.heap else STRIKE_TIMER_MAX_SLEEP
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), min(delay, STRIKE_TIMER_MAX_SLEEP))
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+            for ts, user_id, kind in self.due(time.time()):
+                try:
+                    await expire_strike(user_id, kind, ts)
+                except Exception as e:
+                    print(f"[Error expiring strike for {user_id}] {e}")
+
+
+strike_timers = StrikeTimers()
+strike_timers.rebuild()
+
+
+async def expire_strike(user_id: str, kind: str, ts: float):
+    def change(entry: dict) -> bool:
+        times = entry["expires"][kind]
+        if ts not in times:
+            return False  # removed or already expired (maybe by another process)
+        times.remove(ts)
+        entry[kind] = len(times)
+        return True
+
+    entry, expired = change_strikes(user_id, change)
+    if not expired:
+        return
+    strike_timers.stats["expired"] += 1
+    if entry[kind] >= STRIKE_LIMIT:
+        return
 
-def save_strike_data():
-    user_data["strikes"] = active_strikes
-    save_user_data(user_data)
+    # Strikes from before guild ids were stored: the bot only runs in one guild
+    guild_id = entry.get("guild_id")
+    guilds = [bot.get_guild(guild_id)] if guild_id else bot.guilds
+    for guild in guilds:
+        role = get_role(guild, STRIKE_ROLES[kind]) if guild else None
+        if not role:
+            continue
+        # Not resolve_member: nothing refreshes LRU entries, and the ban role may
+        # have been added after one was fetched. Expiries are rare, so fetch.
+        member = guild.get_member(int(user_id))
+        if member is None:
+            try:
+                member = await rest.call(PRIORITY_STATE, f"guild.members:{guild.id}", guild.fetch_member, int(user_id))
+            except discord.NotFound:
+                continue
+            member_lru.put(member)
+        if not has_role(member, role):
+            continue
+        await rest.call(PRIORITY_STATE, f"member.roles:{guild.id}", member.remove_roles, role,
+                        reason=f"{kind.capitalize()} strike expired")
+        strike_timers.stats["roles_removed"] += 1
+
+        log_channel = guild.get_channel(1357869099958403072)
+        if log_channel:
+            embed = discord.Embed(
+                title="**Strike Expired**",
+                description=f"A **{kind}** strike on {member.mention} has expired.",
+                color=discord.Color.green()
+            )
+            embed.add_field(name="Host Strikes", value=entry["host"], inline=True)
+            embed.add_field(name="Grief Strikes", value=entry["grief"], inline=True)
+            embed.add_field(name="Role Removed", value=role.name, inline=False)
+            audit_log.post(log_channel, embed)
 
 # ——— /strike ———
 @bot.tree.command(name="strike", description="Add a strike to a player.")
@@ -645,39 +3333,28 @@ def save_strike_data():
     ]
 )
 async def strike(interaction: discord.Interaction, user: discord.Member, striketype: str, reason: str):
-    await interaction.response.defer(thinking=False, ephemeral=True)
+    await defer_response(interaction, thinking=False, ephemeral=True)
     guild = interaction.guild
 
-    # Get or init user data
-    player_data = active_strikes.get(str(user.id), {"host": 0, "grief": 0})
-
-    # Strike cap check
-    if player_data[striketype] >= 3:
-        await interaction.followup.send(
-            f"**Error:** {user.mention} already has 3 `{striketype}` strikes. You cannot add more.",
+    # Add strike (refused at the cap)
+    player_data, added = adjust_strike(user.id, striketype, 1, guild.id)
+    if not added:
+        await send_followup(interaction,
+            f"**Error:** {user.mention} already has {STRIKE_LIMIT} `{striketype}` strikes. You cannot add more."
+            if player_data[striketype] >= STRIKE_LIMIT else "**Error:** Couldn't save the strike. Try again.",
             ephemeral=True
         )
         return
 
-    # Add strike
-    player_data[striketype] += 1
-    active_strikes[str(user.id)] = player_data
-    save_strike_data()
-
     role_assigned = None
-    if player_data["host"] >= 3:
-        r = discord.utils.get(guild.roles, name="Host Back Ban")
-        if r and r not in user.roles:
-            await user.add_roles(r)
-            role_assigned = r.name
+    for kind in ("host", "grief"):
+        if player_data[kind] >= STRIKE_LIMIT:
+            r = get_role(guild, STRIKE_ROLES[kind])
+            if r and not has_role(user, r):
+                await rest.call(PRIORITY_STATE, f"member.roles:{guild.id}", user.add_roles, r)
+                role_assigned = r.name
 
-    if player_data["grief"] >= 3:
-        r = discord.utils.get(guild.roles, name="Griefing Bail")
-        if r and r not in user.roles:
-            await user.add_roles(r)
-            role_assigned = r.name
-
-    await interaction.followup.send("Strike added successfully.", ephemeral=True)
+    await send_followup(interaction, "Strike added successfully.", ephemeral=True)
 
     # Log channel embed
     log_channel = guild.get_channel(1357869099958403072)
@@ -694,7 +3371,7 @@ async def strike(interaction: discord.Interaction, user: discord.Member, striket
         if role_assigned:
             embed.add_field(name="Role Assigned", value=role_assigned, inline=False)
 
-        await log_channel.send(embed=embed)
+        audit_log.post(log_channel, embed)
 
     # Strikes channel embed
     strikes_channel = discord.utils.get(guild.text_channels, name="host-strikes")
@@ -708,7 +3385,7 @@ async def strike(interaction: discord.Interaction, user: discord.Member, striket
         embed.add_field(name="Host Strikes", value=player_data["host"], inline=True)
         embed.add_field(name="Grief Strikes", value=player_data["grief"], inline=True)
 
-        await strikes_channel.send(embed=embed)
+        audit_log.post(strikes_channel, embed)
 
 
 # ——— /strikeremove ———
@@ -720,42 +3397,29 @@ async def strike(interaction: discord.Interaction, user: discord.Member, striket
     ]
 )
 async def strikeremove(interaction: discord.Interaction, user: discord.Member, striketype: str, reason: str):
-    await interaction.response.defer(thinking=False, ephemeral=True)
+    await defer_response(interaction, thinking=False, ephemeral=True)
     guild = interaction.guild
-    user_id = str(user.id)
-
-    # Get or initialize the player's strike data
-    player_data = active_strikes.get(user_id, {"host": 0, "grief": 0})
 
-    # Error if the user doesn't have a strike of that type
-    if player_data.get(striketype, 0) <= 0:
-        await interaction.followup.send(
-            f"{user.mention} has no **{striketype}** strikes to remove.",
+    # Remove a strike; error if the user doesn't have one of that type
+    player_data, removed = adjust_strike(user.id, striketype, -1)
+    if not removed:
+        await send_followup(interaction,
+            f"{user.mention} has no **{striketype}** strikes to remove."
+            if player_data[striketype] <= 0 else "**Error:** Couldn't save the change. Try again.",
             ephemeral=True
         )
         return
 
-    # Remove a strike
-    player_data[striketype] -= 1
-    active_strikes[user_id] = player_data
-    save_strike_data()
-
     # Remove associated role if below threshold
     role_removed = None
-    if striketype == "host" and player_data["host"] < 3:
-        role = discord.utils.get(guild.roles, name="Host Back Ban")
-        if role and role in user.roles:
-            await user.remove_roles(role)
-            role_removed = role.name
-
-    elif striketype == "grief" and player_data["grief"] < 3:
-        role = discord.utils.get(guild.roles, name="Griefing Bail")
-        if role and role in user.roles:
-            await user.remove_roles(role)
+    if player_data[striketype] < STRIKE_LIMIT:
+        role = get_role(guild, STRIKE_ROLES[striketype])
+        if has_role(user, role):
+            await rest.call(PRIORITY_STATE, f"member.roles:{guild.id}", user.remove_roles, role)
             role_removed = role.name
 
     # Confirm to command user
-    await interaction.followup.send("Strike successfully removed.", ephemeral=True)
+    await send_followup(interaction, "Strike successfully removed.", ephemeral=True)
 
     # Log to #strike-logs channel
     log_channel = guild.get_channel(1357869099958403072)
@@ -772,7 +3436,7 @@ async def strikeremove(interaction: discord.Interaction, user: discord.Member, s
         if role_removed:
             embed.add_field(name="Role Removed", value=role_removed, inline=False)
 
-        await log_channel.send(embed=embed)
+        audit_log.post(log_channel, embed)
 
     # Send notification to public channel
     strikes_channel = discord.utils.get(guild.text_channels, name="host-strikes")
@@ -786,7 +3450,7 @@ async def strikeremove(interaction: discord.Interaction, user: discord.Member, s
         embed.add_field(name="Host Strikes", value=player_data["host"], inline=True)
         embed.add_field(name="Grief Strikes", value=player_data["grief"], inline=True)
 
-        await strikes_channel.send(embed=embed)
+        audit_log.post(strikes_channel, embed)
 
 
 # ——— /strikecheck ———
@@ -805,25 +3469,24 @@ async def strikecheck(interaction: discord.Interaction, user: discord.Member):
     )
     embed.add_field(name="Host Strikes",      value=player_data["host"], inline=True)
     embed.add_field(name="Grief Strikes",     value=player_data["grief"],inline=True)
-    embed.add_field(name="Host Back Ban Role",value="Yes" if discord.utils.get(guild.roles, name="Host Back Ban") in user.roles else "No", inline=True)
-    embed.add_field(name="Griefing Bail Role",value="Yes" if discord.utils.get(guild.roles, name="Griefing Bail") in user.roles else "No", inline=True)
+    embed.add_field(name=f"{STRIKE_ROLES['host']} Role", value="Yes" if has_role(user, get_role(guild, STRIKE_ROLES["host"])) else "No", inline=True)
+    embed.add_field(name=f"{STRIKE_ROLES['grief']} Role", value="Yes" if has_role(user, get_role(guild, STRIKE_ROLES["grief"])) else "No", inline=True)
+    for kind in STRIKE_ROLES:
+        times = [ts for ts in player_data.get("expires", {}).get(kind, []) if ts is not None]
+        if times:
+            embed.add_field(name=f"Next {kind.capitalize()} Strike Expires", value=f"<t:{int(min(times))}:R>", inline=True)
 
-    await interaction.response.send_message(embed=embed, ephemeral=True)
+    await send_response(interaction, embed=embed, ephemeral=True)
 
 @bot.tree.command(name="displayset", description="Set your in-game display name")
 @app_commands.describe(name="Your display name")
 async def displayset(interaction: discord.Interaction, name: str):
     user_data[str(interaction.user.id)] = user_data.get(str(interaction.user.id), {})
     user_data[str(interaction.user.id)]["display_name"] = name.strip()
+    user_store.mark_dirty(interaction.user.id)
+    invalidate_profile(interaction.user.id)
 
-    try:
-        with open(user_data_file, "w") as f:
-            json.dump(user_data, f, indent=2)
-    except Exception as e:
-        print(f"[ERROR] Could not save display name: {e}")
-        return await interaction.response.send_message("Failed to save your display name.", ephemeral=True)
-
-    await interaction.response.send_message(f"Your display name has been set to `{name}`.", ephemeral=True)
+    await send_response(interaction, f"Your display name has been set to `{name}`.", ephemeral=True)
 
 
 from typing import Optional
@@ -843,7 +3506,35 @@ async def showdisplay(interaction: discord.Interaction, user: Optional[discord.M
     else:
         response_message = f"{user.mention} has not set an in-game name yet."
 
-    await interaction.response.send_message(response_message, ephemeral=True)
+    await send_response(interaction, response_message, ephemeral=True)
+
+
+def format_duration(seconds: int) -> str:
+    hours, seconds = divmod(int(seconds), 3600)
+    minutes = seconds // 60
+    return f"{hours}h {minutes}m" if hours else f"{minutes}m"
+
+
+@bot.tree.command(name="stats", description="Show a player's league match stats.")
+@app_commands.describe(user="The player to look up (defaults to yourself)")
+async def stats_command(interaction: discord.Interaction, user: Optional[discord.Member] = None):
+    # Counters are kept current by match_journal, so this never reads the history
+    user = user or interaction.user
+    stats = user_data.get(str(user.id), {}).get("stats")
+    if not stats or not stats.get("played"):
+        return await send_response(interaction, f"{user.mention} hasn't finished a league match yet.", ephemeral=True)
+
+    def breakdown(counts: dict, names: dict) -> str:
+        ordered = sorted(counts.items(), key=lambda kv: -kv[1])
+        return " • ".join(f"{names.get(k, k)} {n}" for k, n in ordered) or "None"
+
+    embed = discord.Embed(title=f"League Stats for {user.display_name}", color=discord.Color.blue())
+    embed.add_field(name="Matches Played", value=stats["played"], inline=True)
+    embed.add_field(name="Matches Hosted", value=stats.get("hosted", 0), inline=True)
+    embed.add_field(name="Average Duration", value=format_duration(stats.get("seconds", 0) / stats["played"]), inline=True)
+    embed.add_field(name="Regions", value=breakdown(stats.get("regions", {}), {}), inline=False)
+    embed.add_field(name="Formats", value=breakdown(stats.get("formats", {}), MATCHTYPE_DISPLAY), inline=False)
+    await send_response(interaction, embed=embed, ephemeral=True)
 
 
 @bot.tree.command(name="help", description="View a list of PRL bot commands.")
@@ -859,10 +3550,13 @@ async def help_command(interaction: discord.Interaction):
         name="**League Hosting**",
         value=(
             "`/prlhostleague` - Host a PRL league match.\n"
+            "`/queue` - Queue up; a lobby opens once enough players wait.\n"
+            "`/leavequeue` - Leave the matchmaking queue.\n"
             "`/add` - Manually add a player to a league match.\n"
             "`/leave` - Leave the currently joined match.\n"
             "`/remove` - Remove a player from the match.\n"
-            "`/endleague` - End an active league match."
+            "`/endleague` - End an active league match.\n"
+            "`/balance` - Split your lobby into rank-balanced teams."
         ),
         inline=False
     )
@@ -873,7 +3567,7 @@ async def help_command(interaction: discord.Interaction):
         value=(
             "`/strike` - Issue a strike to a user.\n"
             "`/strikeremove` - Remove a strike from a user.\n"
-            "`/strikecheck` - View a user's current strikes."
+            "`/strikecheck` - View a user's current strikes and when they expire."
         ),
         inline=False
     )
@@ -893,56 +3587,27 @@ async def help_command(interaction: discord.Interaction):
         name="**Other**",
         value=(
             "`/topplayers` - View top-ranked players.\n"
+            "`/stats` - View a player's match stats.\n"
             "`/about` - Information about the PRL BOT."
         ),
         inline=False
     )
 
     embed.set_footer(text="Need help? Contact a league admin or mod.")
-    await interaction.response.send_message(embed=embed, ephemeral=True)
+    await send_response(interaction, embed=embed, ephemeral=True)
 
 
 
-# Constants and mappings
-RANK_NAMES = {
-    "r1": "R1 - Drone",
-    "r2": "R2 - Bot",
-    "r3": "R3 - Noob",
-    "r4": "R4 - Semi-Pro",
-    "r5": "R5 - Pro",
-    "r6": "R6 - Ancient",
-    "r7": "R7 - Mythical",
-    "r8": "R8 - Master",
-    "r9": "R9 - Supreme",
-    "r10": "R10 - Overlord",
-    "r11": "R11 - Celestial"
-}
-# Hierarchy from highest (r11) to lowest (r1)
-RANK_ORDER = list(RANK_NAMES.keys())[::-1]
-TIER_NAMES = ["low", "mid", "high"]
-# Tier ordering for tiebreaks: higher tier first
-TIER_ORDER = {"high": 2, "mid": 1, "low": 0, "unranked": -1}
+LEADERBOARD_RANKS = RANK_ORDER[:4]  # r11,r10,r9,r8
+LEADERBOARD_SIZE = 10
+# Rank-log refreshes inside this window are merged into a single edit
+LEADERBOARD_REFRESH_WINDOW = float(os.getenv("PRL_LEADERBOARD_WINDOW", "30"))
 
-USER_DATA_FILE = "user_data_prl.json"
 LOG_CHANNEL_ID = 1357869099958403072
 
-# JSON load/save helpers
-def load_user_data():
-    if not os.path.exists(USER_DATA_FILE):
-        return {}
-    with open(USER_DATA_FILE, "r") as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return {}
-
-def save_user_data(data):
-    with open(USER_DATA_FILE, "w") as f:
-        json.dump(data, f, indent=4)
-
 # Helper for ephemeral error messages
 def send_error(channel: discord.TextChannel, content: str):
-    return channel.send(content, delete_after=4)
+    return rest.call(PRIORITY_STATE, f"channel.send:{channel.id}", channel.send, content, delete_after=4)
 
 # Handle manual rank messages in #rank-logs
 @bot.event
@@ -971,17 +3636,18 @@ async def on_message(message: discord.Message):
         return
 
     # Role objects
-    old_rank_role = discord.utils.get(message.guild.roles, name=RANK_NAMES.get(old_rank))
-    old_tier_role = discord.utils.get(message.guild.roles, name=old_tier.capitalize() if old_tier else None)
-    new_rank_role = discord.utils.get(message.guild.roles, name=RANK_NAMES.get(new_rank))
-    new_tier_role = discord.utils.get(message.guild.roles, name=new_tier.capitalize() if new_tier else None)
+    roles = guild_roles(message.guild)
+    old_rank_role = roles.named(RANK_NAMES.get(old_rank))
+    old_tier_role = roles.named(tier_role_name(old_tier))
+    new_rank_role = roles.named(RANK_NAMES.get(new_rank))
+    new_tier_role = roles.named(tier_role_name(new_tier))
 
     # Strict validation: old rank and tier must be present on user
     if old_rank != "n/a":
-        if not old_rank_role or old_rank_role not in user.roles:
+        if not has_role(user, old_rank_role):
             return await send_error(message.channel, f"**Error:** {user.mention} does not have rank `{RANK_NAMES.get(old_rank)}`.")
     if old_tier:
-        if not old_tier_role or old_tier_role not in user.roles:
+        if not has_role(user, old_tier_role):
             return await send_error(message.channel, f"**Error:** {user.mention} does not have tier `{old_tier.capitalize()}`.")
 
     # Validate new roles exist
@@ -991,19 +3657,30 @@ async def on_message(message: discord.Message):
         return await send_error(message.channel, f"**Error:** Invalid new tier `{new_tier}`.")
 
     # Apply role changes
-    to_remove = [r for r in (old_rank_role, old_tier_role) if r and r in user.roles]
+    to_remove = [r for r in (old_rank_role, old_tier_role) if has_role(user, r)]
     if to_remove:
-        await user.remove_roles(*to_remove)
-    to_add = [r for r in (new_rank_role, new_tier_role) if r and r not in user.roles]
+        await rest.call(PRIORITY_STATE, f"member.roles:{message.guild.id}", user.remove_roles, *to_remove)
+    to_add = [r for r in (new_rank_role, new_tier_role) if r and not has_role(user, r)]
     if to_add:
-        await user.add_roles(*to_add)
-
-    # Persist data
-    data = load_user_data()
-    data[str(user.id)] = {"rank": new_rank, "tier": new_tier or "n/a"}
-    save_user_data(data)
+        await rest.call(PRIORITY_STATE, f"member.roles:{message.guild.id}", user.add_roles, *to_add)
+
+    # The member_update event may land after we refresh, so index the new roles now
+    index = leaderboard_indexes.get(message.guild.id)
+    if index:
+        index.update(user, [r for r in user.roles if r not in to_remove] + to_add)
+    if MEMBER_CACHE_POLICY != "full" and message.guild.get_member(user.id) is None:
+        # Newly ranked: cache them so their next role change reaches the index
+        message.guild._add_member(user)
+
+    # Persist data: one journal line now, folded into the snapshot by compaction
+    rank_journal.append(
+        user.id, new_rank, new_tier or "n/a",
+        from_rank=old_rank, from_tier=old_tier or "n/a", by=message.author.id
+    )
+    invalidate_profile(user.id)
 
-    await message.channel.send(
+    await rest.call(
+        PRIORITY_STATE, f"channel.send:{message.channel.id}", message.channel.send,
         f"Updated {user.mention}: rank → `{new_rank}` | tier → `{new_tier or 'n/a'}`",
         delete_after=4
     )
@@ -1018,40 +3695,202 @@ async def on_message(message: discord.Message):
         embed = discord.Embed(
             title="Rank Change Logged",
             color=discord.Color.purple(),
-            timestamp=datetime.utcnow()
+            timestamp=discord.utils.utcnow()
         )
         embed.add_field(name="User", value=user.mention, inline=True)
         embed.add_field(name="Previous", value=prev, inline=True)
         embed.add_field(name="New", value=newv, inline=True)
         embed.set_footer(text=f"User ID: {user.id}")
-        await log_ch.send(embed=embed)
+        audit_log.post(log_ch, embed)
+
+    # Auto-update whenever an R8+ rank is involved; unchanged top 10s are skipped
+    threshold = set(LEADERBOARD_RANKS)
+    if old_rank in threshold or new_rank in threshold:
+        leaderboard_publisher.request_refresh(message.guild)
+
+# ——— Leaderboard index ———
+class LeaderboardIndex:
+    """Per-guild index of R8+ members, kept current from member events.
+
+    ``entries`` stays sorted by (rank, tier high→low, name), so a leaderboard
+    refresh is a slice instead of a scan of every guild member.
+    """
+
+    def __init__(self):
+        self.entries: list[tuple] = []
+        self.by_member: dict[int, tuple] = {}
+        self.built = False
+
+    @staticmethod
+    def entry_for(member: discord.Member, roles=None) -> Optional[tuple]:
+        roles = member.roles if roles is None else roles
+        index = guild_roles(member.guild)
+        code = tier_role = None
+        for r in roles:
+            rank = index.rank_codes.get(r.id)
+            if rank in LEADERBOARD_RANKS and (code is None or RANK_POSITION[rank] < RANK_POSITION[code]):
+                code = rank
+            if tier_role is None:
+                tier_role = index.tier_codes.get(r.id)
+        if not code:
+            return None
+        tier_role = tier_role or "unranked"
+        name = member.display_name
+        return (RANK_POSITION[code], -TIER_ORDER.get(tier_role, -1), name.lower(), member.id,
+                name, code, tier_role)
+
+    def build(self, members):
+        entries = [e for e in (self.entry_for(m) for m in members) if e]
+        entries.sort()
+        self.entries = entries
+        self.by_member = {e[3]: e for e in entries}
+        self.built = True
+
+    def remove(self, member_id: int):
+        entry = self.by_member.pop(member_id, None)
+        if entry:
+            i = bisect.bisect_left(self.entries, entry)
+            if i < len(self.entries) and self.entries[i] == entry:
+                del self.entries[i]
+
+    def update(self, member: discord.Member, roles=None):
+        entry = self.entry_for(member, roles)
+        if self.by_member.get(member.id) == entry:
+            return
+        self.remove(member.id)
+        if entry:
+            bisect.insort(self.entries, entry)
+            self.by_member[member.id] = entry
 
-    # Auto-update on crossing R8 threshold
-    threshold = set(RANK_ORDER[:4])  # r11,r10,r9,r8
-    if (old_rank in threshold) != (new_rank in threshold) or (old_rank in threshold and old_rank != new_rank):
-        await update_leaderboard(message.guild)
+    def top(self, n: int = LEADERBOARD_SIZE) -> list[tuple]:
+        return self.entries[:n]
 
-# Leaderboard updater: show top 10 players (R8+), breaking ties by tier then name
-async def update_leaderboard(guild: discord.Guild) -> bool:
-    channel = discord.utils.get(guild.text_channels, name="top-players")
-    if not channel:
-        return False
 
-    entries = []
-    # Collect R8+ members with tier index
-    for member in guild.members:
-        for code in RANK_ORDER[:4]:  # r11→r8
-            role = discord.utils.get(guild.roles, name=RANK_NAMES[code])
-            if role and role in member.roles:
-                tier_role = next((r.name.lower() for r in member.roles if r.name.lower() in TIER_NAMES), "unranked")
-                tier_index = TIER_ORDER.get(tier_role, -1)
-                entries.append((member.display_name, code, RANK_NAMES[code], tier_role.capitalize(), tier_index))
-                break
+leaderboard_indexes: dict[int, LeaderboardIndex] = {}
+
+_index_locks: dict[int, asyncio.Lock] = {}
+
+async def get_leaderboard_index(guild: discord.Guild) -> LeaderboardIndex:
+    index = leaderboard_indexes.get(guild.id)
+    if index is None:
+        index = leaderboard_indexes[guild.id] = LeaderboardIndex()
+    if not index.built:
+        async with _index_locks.setdefault(guild.id, asyncio.Lock()):
+            if not index.built:
+                index.build(await load_guild_members(guild))
+    return index
+
+
+# ——— Member cache ———
+def member_cache_roles() -> set[str]:
+    """Role names whose holders stay in the member cache under the "roles" policy.
+
+    Just the rank roles by default: the leaderboard index is built from them
+    and needs their role updates; profiles resolve whatever member they get.
+    """
+    configured = os.getenv("PRL_CACHE_ROLES")
+    if configured:
+        return {name.strip() for name in configured.split(",") if name.strip()}
+    return set(RANK_NAMES.values())
+
+
+MEMBER_CACHE_ROLES = member_cache_roles()
+
+
+def keeps_cached(member: discord.Member) -> bool:
+    if MEMBER_CACHE_POLICY == "full" or member.id == bot.user.id:
+        return True
+    return any(r.name in MEMBER_CACHE_ROLES for r in member.roles)
+
+
+async def load_guild_members(guild: discord.Guild) -> list[discord.Member]:
+    """All members of a guild, for the one-off index build.
+
+    Under the "full" policy they are already cached. Otherwise the guild is
+    chunked lazily without caching and the holders of the configured roles
+    are put in the cache straight from that result (no further requests),
+    so their role updates keep reaching the indexes.
+    """
+    if MEMBER_CACHE_POLICY == "full" or guild.chunked:
+        return list(guild.members)
+    members = await guild.chunk(cache=False)
+    for member in members:
+        if keeps_cached(member):
+            guild._add_member(member)
+    return members
+
+
+class MemberLRU:
+    """Bounded cache of members fetched on demand (those not in the guild cache)."""
+
+    def __init__(self, size: int = MEMBER_LRU_SIZE):
+        self.size = size
+        self._members: "OrderedDict[tuple[int, int], discord.Member]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0}
 
-    # Sort by rank, tier (high→low), then name
-    entries.sort(key=lambda e: (RANK_ORDER.index(e[1]), -e[4], e[0].lower()))
-    top10 = entries[:10]
+    def get(self, guild_id: int, user_id: int) -> Optional[discord.Member]:
+        member = self._members.get((guild_id, user_id))
+        if member is not None:
+            self._members.move_to_end((guild_id, user_id))
+        return member
 
+    def put(self, member: discord.Member):
+        self._members[(member.guild.id, member.id)] = member
+        self._members.move_to_end((member.guild.id, member.id))
+        while len(self._members) > self.size:
+            self._members.popitem(last=False)
+
+    def discard(self, guild_id: int, user_id: int):
+        self._members.pop((guild_id, user_id), None)
+
+
+member_lru = MemberLRU()
+
+
+async def resolve_member(guild: discord.Guild, user_id: int) -> Optional[discord.Member]:
+    """Guild cache, then the LRU, then one ``fetch_member`` call."""
+    member = guild.get_member(user_id) or member_lru.get(guild.id, user_id)
+    if member is not None:
+        member_lru.stats["hits"] += 1
+        return member
+    member_lru.stats["misses"] += 1
+    try:
+        member = await rest.call(PRIORITY_STATE, f"guild.members:{guild.id}", guild.fetch_member, user_id)
+    except discord.NotFound:
+        return None
+    member_lru.put(member)
+    return member
+
+
+@bot.event
+async def on_member_update(before: discord.Member, after: discord.Member):
+    member_lru.discard(after.guild.id, after.id)
+    if before.roles != after.roles:
+        invalidate_profile(after.id, after.guild.id)
+    index = leaderboard_indexes.get(after.guild.id)
+    if index and (before.roles != after.roles or before.display_name != after.display_name):
+        index.update(after)
+    if not keeps_cached(after):
+        after.guild._remove_member(after)  # lost their last kept role
+
+
+@bot.event
+async def on_member_join(member: discord.Member):
+    index = leaderboard_indexes.get(member.guild.id)
+    if index:
+        index.update(member)
+
+
+@bot.event
+async def on_member_remove(member: discord.Member):
+    member_lru.discard(member.guild.id, member.id)
+    invalidate_profile(member.id, member.guild.id)
+    index = leaderboard_indexes.get(member.guild.id)
+    if index:
+        index.remove(member.id)
+
+
+def build_leaderboard_embed(top10: list[tuple]) -> discord.Embed:
     if not top10:
         embed = discord.Embed(
             title="Top Players Leaderboard",
@@ -1065,32 +3904,117 @@ async def update_leaderboard(guild: discord.Guild) -> bool:
             color=discord.Color.dark_gold()
         )
         medals = ["🥇", "🥈", "🥉"]
-        for i, (name, _, rank_str, tier_str, _) in enumerate(top10):
+        for i, (name, _, rank_str, tier_str) in enumerate(top10):
             medal = medals[i] if i < len(medals) else f"#{i+1}"
             embed.description += f"{medal} **{name}**\n        └— Rank: `{rank_str} {tier_str}`\n\n"
         embed.description += "═══════════════════════════════"
 
-    embed.set_footer(text=f"Last Updated • {datetime.now().strftime('%B %d, %Y')}")
+    embed.set_footer(text=f"Last Updated • {datetime.datetime.now().strftime('%B %d, %Y')}")
+    return embed
+
+
+class LeaderboardPublisher:
+    """Publishes the pinned #top-players embed with as few API calls as possible.
+
+    The pinned message id is cached per guild (no ``channel.pins()`` after the
+    first publish), refresh requests inside the window merge into one edit, and
+    an unchanged top 10 skips the edit entirely.
+    """
+
+    def __init__(self, window: float = LEADERBOARD_REFRESH_WINDOW):
+        self.window = window
+        self.channel_ids: dict[int, int] = {}
+        self.message_ids: dict[int, int] = {}
+        self.hashes: dict[int, str] = {}
+        self._pending: dict[int, asyncio.Task] = {}
+        self._locks: dict[int, asyncio.Lock] = {}
+        self.stats = {"requested": 0, "merged": 0, "edits": 0, "unchanged": 0}
 
-    # Update or post new embed
-    pins = await channel.pins()
-    for msg in pins:
-        if msg.author == guild.me and msg.embeds:
-            await msg.edit(embed=embed)
+    def request_refresh(self, guild: discord.Guild):
+        self.stats["requested"] += 1
+        task = self._pending.get(guild.id)
+        if task and not task.done():
+            self.stats["merged"] += 1
+            return
+        self._pending[guild.id] = asyncio.create_task(self._refresh_later(guild))
+
+    async def _refresh_later(self, guild: discord.Guild):
+        await asyncio.sleep(self.window)
+        self._pending.pop(guild.id, None)
+        try:
+            await self.publish(guild)
+        except Exception as e:
+            print(f"[Error updating leaderboard] {e}")
+
+    def _channel(self, guild: discord.Guild) -> Optional[discord.TextChannel]:
+        channel = guild.get_channel(self.channel_ids.get(guild.id, 0))
+        if not channel:
+            channel = discord.utils.get(guild.text_channels, name="top-players")
+            if channel:
+                self.channel_ids[guild.id] = channel.id
+        return channel
+
+    async def publish(self, guild: discord.Guild) -> bool:
+        """Publish the current top 10; returns False if unchanged or no channel."""
+        channel = self._channel(guild)
+        if not channel:
+            return False
+
+        top10 = [
+            (name, code, RANK_NAMES[code], tier_role.capitalize())
+            for _, _, _, _, name, code, tier_role in (await get_leaderboard_index(guild)).top(LEADERBOARD_SIZE)
+        ]
+        digest = hashlib.sha1(json.dumps(top10).encode()).hexdigest()
+
+        lock = self._locks.setdefault(guild.id, asyncio.Lock())
+        async with lock:
+            if self.hashes.get(guild.id) == digest:
+                self.stats["unchanged"] += 1
+                return False
+            embed = build_leaderboard_embed(top10)
+            await self._edit_or_post(guild, channel, embed)
+            self.hashes[guild.id] = digest
+            self.stats["edits"] += 1
             return True
-    msg = await channel.send(embed=embed)
-    await msg.pin()
-    return True
+
+    async def _edit_or_post(self, guild: discord.Guild, channel: discord.TextChannel, embed: discord.Embed):
+        msg_id = self.message_ids.get(guild.id)
+        if msg_id:
+            try:
+                message = channel.get_partial_message(msg_id)
+                await rest.call(PRIORITY_COSMETIC, f"message.edit:{channel.id}", message.edit, embed=embed)
+                return
+            except discord.NotFound:
+                self.message_ids.pop(guild.id, None)
+
+        # First publish (or the pin was deleted): find our pin once, else post a new one
+        pins = await rest.call(PRIORITY_COSMETIC, f"channel.pins:{channel.id}", channel.pins)
+        for msg in pins:
+            if msg.author == guild.me and msg.embeds:
+                await rest.call(PRIORITY_COSMETIC, f"message.edit:{channel.id}", msg.edit, embed=embed)
+                self.message_ids[guild.id] = msg.id
+                return
+        msg = await rest.call(PRIORITY_COSMETIC, f"channel.send:{channel.id}", channel.send, embed=embed)
+        await rest.call(PRIORITY_COSMETIC, f"channel.pins:{channel.id}", msg.pin)
+        self.message_ids[guild.id] = msg.id
+
+
+leaderboard_publisher = LeaderboardPublisher()
+
+
+# Leaderboard updater: show top 10 players (R8+), breaking ties by tier then name
+async def update_leaderboard(guild: discord.Guild) -> bool:
+    return await leaderboard_publisher.publish(guild)
 
 # Slash command to manually refresh
 @bot.tree.command(name="topplayers", description="Manually update the Top Players leaderboard.")
 async def topplayers(interaction: discord.Interaction):
-    await interaction.response.defer(ephemeral=True)
+    await defer_response(interaction, ephemeral=True)
     updated = await update_leaderboard(interaction.guild)
     if updated:
-        await interaction.followup.send("Top players leaderboard updated.", ephemeral=True)
+        await send_followup(interaction, "Top players leaderboard updated.", ephemeral=True)
     else:
-        await interaction.followup.send("Leaderboard is already up-to-date or channel not found.", ephemeral=True)
+        await send_followup(interaction, "Leaderboard is already up-to-date or channel not found.", ephemeral=True)
 
 
 import time
@@ -1119,46 +4043,106 @@ async def about(interaction: discord.Interaction):
     embed.add_field(name="Key Features", value="• Match Hosting\n• Rank Tracking\n• Strike System", inline=True)
     embed.set_footer(text=f"Uptime: {get_uptime()} • PRL BOT")
 
-    await interaction.response.send_message(embed=embed, ephemeral=True)
+    await send_response(interaction, embed=embed, ephemeral=True)
 
 
 
 
+def _command_name(interaction: discord.Interaction) -> str:
+    return interaction.command.qualified_name if interaction.command else "unknown"
+
+
+def _since_created(interaction: discord.Interaction) -> float:
+    return (discord.utils.utcnow() - interaction.created_at).total_seconds()
+
+
 @bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    metrics.observe_command(_command_name(interaction), "ok", _since_created(interaction))
+    finish_trace(interaction, "ok")
+
+
+@bot.tree.error
 async def on_app_command_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
+    metrics.observe_command(_command_name(interaction), "error", _since_created(interaction))
+    finish_trace(interaction, "error")
     try:
         # Known error: Missing permissions
         if isinstance(error, app_commands.CheckFailure):
-            await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+            await send_response(interaction, "You don't have permission to use this command.", ephemeral=True)
 
         # Known error: Error occurred while executing command
         elif isinstance(error, app_commands.CommandInvokeError):
             print(f"[CommandInvokeError] {error.original}")
             if interaction.response.is_done():
-                await interaction.followup.send("An error occurred while executing the command. Please try again later.", ephemeral=True)
+                await send_followup(interaction, "An error occurred while executing the command. Please try again later.", ephemeral=True)
             else:
-                await interaction.response.send_message("An error occurred while executing the command. Please try again later.", ephemeral=True)
+                await send_response(interaction, "An error occurred while executing the command. Please try again later.", ephemeral=True)
 
         # Fallback for unexpected errors
         else:
             print(f"[AppCommandError] {error}")
             if interaction.response.is_done():
-                await interaction.followup.send("An unexpected error occurred. Please try again later.", ephemeral=True)
+                await send_followup(interaction, "An unexpected error occurred. Please try again later.", ephemeral=True)
             else:
-                await interaction.response.send_message("An unexpected error occurred. Please try again later.", ephemeral=True)
+                await send_response(interaction, "An unexpected error occurred. Please try again later.", ephemeral=True)
 
     except Exception as e:
         print(f"[Error Handler Failed] {e}")
 
 
-@bot.event
-async def on_ready():
+# ——— Command sync ———
+COMMAND_SYNC_FILE = "command_sync.json"
+# Set PRL_DEV_GUILD_ID to sync to one guild only (instant updates while developing)
+DEV_GUILD_ID = os.getenv("PRL_DEV_GUILD_ID")
+FORCE_COMMAND_SYNC = os.getenv("PRL_FORCE_SYNC") == "1"
+
+
+def command_tree_fingerprint(tree: app_commands.CommandTree, guild: Optional[discord.abc.Snowflake] = None) -> str:
+    """Hash of everything Discord stores for our commands (names, options, choices, descriptions)."""
+    payload = [cmd.to_dict(tree) for cmd in tree.get_commands(guild=guild)]
+    payload.sort(key=lambda c: (c.get("type", 1), c["name"]))
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+async def sync_commands(tree: app_commands.CommandTree):
+    """Sync the command tree only when it differs from the last successful sync."""
+    guild = discord.Object(id=int(DEV_GUILD_ID)) if DEV_GUILD_ID else None
+    if guild:
+        tree.copy_global_to(guild=guild)
+    scope = f"guild:{guild.id}" if guild else "global"
+    fingerprint = command_tree_fingerprint(tree, guild=guild)
+
     try:
-        synced = await bot.tree.sync()
-        print(f"🌍 Globally synced {len(synced)} commands.")
+        with open(COMMAND_SYNC_FILE, "r") as f:
+            synced_state = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        synced_state = {}
+    if synced_state.get(scope) == fingerprint and not FORCE_COMMAND_SYNC:
+        print(f"Command tree unchanged since last sync ({scope}); skipping.")
+        return
+
+    try:
+        synced = await tree.sync(guild=guild)
     except Exception as e:
         print(f"❌ Sync failed: {e}")
+        return
+    print(f"🌍 Synced {len(synced)} commands ({scope}).")
+    synced_state[scope] = fingerprint
+    tmp_path = f"{COMMAND_SYNC_FILE}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(synced_state, f, indent=2)
+    os.replace(tmp_path, COMMAND_SYNC_FILE)
 
 
+@bot.event
+async def on_ready():
+    # Fires again on every reconnect, so nothing expensive belongs here
+    print(f"Logged in as {bot.user}.")
+
 
-bot.run(TOKEN)
+if __name__ == "__main__":
+    TOKEN = os.getenv("DISCORD_TOKEN")
+    if not TOKEN:
+        raise RuntimeError("DISCORD_TOKEN env var not found!")
+    bot.run(TOKEN)